@@ -14,8 +14,15 @@ You should have received a copy of the GNU General Public License along with
 this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
 
+# Default amount of memory a single tile of blocked scoring may occupy.
+DEFAULT_MEM_BUDGET = 256 * 2**20
+
 def substitute(x, th, th0):
   return np.dot(np.transpose(th), x) + np.transpose(th0)
 
@@ -30,7 +37,194 @@ def score(data, labels, th, th0):
   comp = (positive(data, th, th0) == labels)
   return np.sum(comp, axis=1)
 
-def best_separator(data, labels, ths, th0s):
+class HyperplaneSet:
+  """A fixed set of m hyperplanes prepared for repeated queries.
+
+  The transposed normals, the unit normals and the offsets scaled by the
+  normal lengths are calculated once and kept in contiguous arrays, so
+  answering a query for a batch of points is a single matrix product.
+  """
+  __slots__ = ('_ths_t', '_th0s', '_unit_ths_t', '_scaled_th0s')
+
+  def __init__(self, ths, th0s):
+    """Prepares the hyperplanes.
+
+    Parameters:
+      ths - a d by m array of floats representing m thetas;
+      th0s - a 1 by m array of the corresponding m theta_0s, or a single
+             number for m == 1.
+    """
+    m = ths.shape[1]
+    th0s = np.broadcast_to(np.reshape(th0s, (1, -1)), (1, m))
+    self._ths_t = np.ascontiguousarray(np.transpose(ths), dtype=np.float64)
+    self._th0s = np.ascontiguousarray(np.transpose(th0s), dtype=np.float64)
+    norms = np.linalg.norm(self._ths_t, axis=1, keepdims=True)
+    self._unit_ths_t = self._ths_t / norms
+    self._scaled_th0s = self._th0s / norms
+
+  def __len__(self):
+    return self._ths_t.shape[0]
+
+  def substitute(self, x):
+    """Same as substitute(x, ths, th0s), returns an m by n array."""
+    return np.dot(self._ths_t, x) + self._th0s
+
+  def signed_dist(self, x):
+    """Same as signed_dist(x, ths, th0s), returns an m by n array."""
+    return np.dot(self._unit_ths_t, x) + self._scaled_th0s
+
+  def positive(self, x):
+    """Same as positive(x, ths, th0s), returns an m by n array."""
+    return np.sign(self.substitute(x))
+
+def score_blocked(data, labels, th, th0, mem_budget=DEFAULT_MEM_BUDGET):
+  """Calculates the same scores as score but in bounded memory.
+
+  Parameters:
+    data - a d by n array of floats (representing n data points in d
+           dimensions);
+    labels - a 1 by n array of elements in (+1, -1), representing target labels;
+    th - a d by m array of floats representing m candidate thetas;
+    th0 - a 1 by m array of the corresponding m candidate theta_0s, or a single
+          number for m == 1;
+    mem_budget - the maximal number of bytes a single tile of the sign matrix
+                 may occupy.
+
+  The m x n sign matrix is never materialized. Candidates and points are split
+  into tiles which fit the memory budget and only the running per-candidate
+  counts of correctly classified points are kept.
+  Returns an array of m scores.
+  """
+  m = th.shape[1]
+  n = data.shape[1]
+  if m == 0 or n == 0:
+    return np.zeros(m, dtype=np.int64)
+  th0 = np.broadcast_to(np.reshape(th0, (1, -1)), (1, m))
+  cand_block, point_block = _tile_shape(m, n, mem_budget)
+
+  counts = np.zeros(m, dtype=np.int64)
+  for c_start in range(0, m, cand_block):
+    c_end = min(c_start + cand_block, m)
+    th_t = np.transpose(th[:, c_start:c_end])
+    th0_t = np.transpose(th0[:, c_start:c_end])
+    for p_start in range(0, n, point_block):
+      p_end = min(p_start + point_block, n)
+      tile = np.dot(th_t, data[:, p_start:p_end])
+      tile += th0_t
+      np.sign(tile, out=tile)
+      counts[c_start:c_end] += np.count_nonzero(
+          tile == labels[:, p_start:p_end], axis=1)
+  return counts
+
+def _tile_shape(m, n, mem_budget):
+  """Chooses the tile shape for the blocked scoring.
+
+  Parameters:
+    m - the number of candidates;
+    n - the number of points;
+    mem_budget - the maximal number of bytes a single tile may occupy.
+
+  A tile entry costs a float64 value and a boolean comparison result. Tiles
+  span all the points when possible, so that every candidate block passes over
+  the data once.
+  Both m and n must be positive.
+  Returns a tuple of the candidate block size and the point block size.
+  """
+  entries = max(1, mem_budget // (np.dtype(np.float64).itemsize + 1))
+  cand_block = min(m, max(1, entries // n))
+  point_block = min(n, max(1, entries // cand_block))
+  return (cand_block, point_block)
+
+def pack_labels(labels):
+  """Packs the labels into bits.
+
+  Parameters:
+    labels - a 1 by n array of elements in (+1, -1).
+
+  Returns a 1 by ceil(n / 8) uint8 array, a bit is set for every +1 label.
+  """
+  return np.packbits(labels > 0, axis=1)
+
+def positive_packed(x, th, th0):
+  """Calculates the same signs as positive but in the bit-packed form.
+
+  Parameters:
+    x - a d by n array of floats (representing n data points in d dimensions);
+    th - a d by m array of floats representing m thetas;
+    th0 - a 1 by m array of the corresponding m theta_0s, or a single number
+          for m == 1.
+
+  Returns a tuple of two m by ceil(n / 8) uint8 arrays: the bits of positive
+  predictions and the bits of non-zero predictions (a point on a hyperplane
+  agrees with no label).
+  """
+  res = substitute(x, th, th0)
+  return (np.packbits(res > 0, axis=1), np.packbits(res != 0, axis=1))
+
+def count_agreement(pos_bits, nonzero_bits, label_bits):
+  """Counts the agreement between packed predictions and packed labels.
+
+  Parameters:
+    pos_bits, nonzero_bits - m by ceil(n / 8) packed predictions (see
+                             positive_packed);
+    label_bits - 1 by ceil(n / 8) packed labels (see pack_labels).
+
+  Returns an array of m counts of the correctly classified points.
+  """
+  agree = np.bitwise_and(np.invert(np.bitwise_xor(pos_bits, label_bits)),
+                         nonzero_bits)
+  return _popcount_rows(agree)
+
+def _popcount_rows(bits):
+  """Counts the set bits in every row of a uint8 array."""
+  if hasattr(np, 'bitwise_count'):
+    return np.sum(np.bitwise_count(bits), axis=1, dtype=np.int64)
+  return np.sum(_POPCOUNT_TABLE[bits], axis=1, dtype=np.int64)
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)],
+                           dtype=np.uint8)
+
+def score_packed(data, labels, th, th0, mem_budget=DEFAULT_MEM_BUDGET):
+  """Calculates the same scores as score using bit-packed signs.
+
+  Parameters:
+    data - a d by n array of floats (representing n data points in d
+           dimensions);
+    labels - a 1 by n array of elements in (+1, -1), representing target labels;
+    th - a d by m array of floats representing m candidate thetas;
+    th0 - a 1 by m array of the corresponding m candidate theta_0s, or a single
+          number for m == 1;
+    mem_budget - the maximal number of bytes a single tile of the substituted
+                 values may occupy.
+
+  The labels are packed once, every tile of predictions is packed right after
+  it is calculated, so the agreement is counted over 1 bit per entry instead
+  of comparing float64 matrices.
+  Returns an array of m scores.
+  """
+  m = th.shape[1]
+  n = data.shape[1]
+  if m == 0 or n == 0:
+    return np.zeros(m, dtype=np.int64)
+  th0 = np.broadcast_to(np.reshape(th0, (1, -1)), (1, m))
+  cand_block, point_block = _tile_shape(m, n, mem_budget)
+  # Point tiles must start on a byte boundary of the packed labels.
+  point_block = max(8, point_block // 8 * 8)
+  label_bits = pack_labels(labels)
+
+  counts = np.zeros(m, dtype=np.int64)
+  for c_start in range(0, m, cand_block):
+    c_end = min(c_start + cand_block, m)
+    for p_start in range(0, n, point_block):
+      p_end = min(p_start + point_block, n)
+      pos_bits, nonzero_bits = positive_packed(data[:, p_start:p_end],
+                                               th[:, c_start:c_end],
+                                               th0[:, c_start:c_end])
+      counts[c_start:c_end] += count_agreement(
+          pos_bits, nonzero_bits, label_bits[:, p_start // 8:(p_end + 7) // 8])
+  return counts
+
+def best_separator(data, labels, ths, th0s, mem_budget=None):
   """Selects the best separator.
 
   Parameters:
@@ -39,14 +233,257 @@ def best_separator(data, labels, ths, th0s):
     labels - a 1 by n array of elements in (+1, -1), representing target labels;
     ths - a d by m array of floats representing m candidate thetas (each theta
           has dimension d by 1);
-    th0s - a 1 by m array of the corresponding m candidate theta_0s.
+    th0s - a 1 by m array of the corresponding m candidate theta_0s;
+    mem_budget - either None or the maximal number of bytes a single tile of
+                 the sign matrix may occupy, the blocked scoring is used in the
+                 latter case (see score_blocked).
 
   Returns tuple of normal in the form of a d by 1 array and an offset in the
   form of 1 by 1 array.
   """
-  idx = np.argmax(score(data, labels, ths, th0s))
+  if mem_budget is None:
+    scores = score(data, labels, ths, th0s)
+  else:
+    scores = score_blocked(data, labels, ths, th0s, mem_budget)
+  idx = np.argmax(scores)
   return (ths[:,idx:idx+1], th0s[:,idx:idx+1])
 
+def best_separator_racing(data, labels, ths, th0s, initial_sample=1000,
+                          growth=2, delta=0.01, seed=None,
+                          mem_budget=DEFAULT_MEM_BUDGET):
+  """Selects the best separator pruning obviously bad candidates early.
+
+  Parameters:
+    data - a d by n array of floats (representing n data points in d
+           dimensions);
+    labels - a 1 by n array of elements in (+1, -1), representing target labels;
+    ths - a d by m array of floats representing m candidate thetas (each theta
+          has dimension d by 1);
+    th0s - a 1 by m array of the corresponding m candidate theta_0s;
+    initial_sample - the number of points the candidates are scored on in the
+                     first round;
+    growth - how many times the sample grows every round;
+    delta - the allowed probability of pruning the best candidate;
+    seed - a seed for the random order in which the points are sampled;
+    mem_budget - the maximal number of bytes a single tile of the sign matrix
+                 may occupy (see score_blocked).
+
+  All the candidates are scored on a growing random sample of the points. After
+  every round the candidates whose Hoeffding upper confidence bound on the
+  accuracy falls below the lower bound of the leader are dropped. Only the
+  survivors are scored on the rest of the data set, so their scores are the
+  full ones and the result is the same as of best_separator unless the best
+  candidate was pruned (with probability at most delta).
+
+  Returns tuple of normal in the form of a d by 1 array, an offset in the form
+  of 1 by 1 array and the number of point evaluations saved compared with the
+  exhaustive score call.
+  """
+  m = ths.shape[1]
+  n = data.shape[1]
+  rng = np.random.default_rng(seed)
+  order = rng.permutation(n)
+  max_rounds = 1 + max(0, int(np.ceil(np.log(n / initial_sample) /
+                                      np.log(growth))))
+
+  alive = np.arange(m)
+  counts = np.zeros(m, dtype=np.int64)
+  evaluations = 0
+  seen = 0
+  sample = min(n, initial_sample)
+  while sample < n and alive.size > 1:
+    idx = order[seen:sample]
+    counts[alive] += score_blocked(data[:, idx], labels[:, idx],
+                                   ths[:, alive], th0s[:, alive], mem_budget)
+    evaluations += alive.size * (sample - seen)
+    seen = sample
+
+    accuracy = counts[alive] / seen
+    # Union bound over all candidates and rounds.
+    radius = np.sqrt(np.log(2 * m * max_rounds / delta) / (2 * seen))
+    alive = alive[accuracy + radius >= np.max(accuracy) - radius]
+    sample = min(n, sample * growth)
+
+  # The survivors are scored on the rest of the points only, their counts
+  # become the full scores.
+  if seen == 0:
+    counts[alive] += score_blocked(data, labels, ths[:, alive],
+                                   th0s[:, alive], mem_budget)
+  elif seen < n:
+    idx = order[seen:]
+    counts[alive] += score_blocked(data[:, idx], labels[:, idx],
+                                   ths[:, alive], th0s[:, alive], mem_budget)
+  evaluations += alive.size * (n - seen)
+  idx = alive[np.argmax(counts[alive])]
+  return (ths[:,idx:idx+1], th0s[:,idx:idx+1], m * n - evaluations)
+
+def score_parallel(data, labels, th, th0, num_workers=None,
+                   mem_budget=DEFAULT_MEM_BUDGET):
+  """Calculates the same scores as score using a pool of processes.
+
+  Parameters:
+    data - a d by n array of floats (representing n data points in d
+           dimensions);
+    labels - a 1 by n array of elements in (+1, -1), representing target labels;
+    th - a d by m array of floats representing m candidate thetas;
+    th0 - a 1 by m array of the corresponding m candidate theta_0s, or a single
+          number for m == 1;
+    num_workers - the number of processes, the number of CPUs by default;
+    mem_budget - the maximal number of bytes a single tile of the sign matrix
+                 may occupy in every worker (see score_blocked).
+
+  Returns an array of m scores.
+  """
+  return _run_parallel('score', data, labels, th, th0, num_workers,
+                       mem_budget)
+
+def signed_dist_parallel(x, th, th0, num_workers=None):
+  """Calculates the same distances as signed_dist using a pool of processes.
+
+  Parameters:
+    x - a d by n array of floats (representing n data points in d dimensions);
+    th - a d by m array of floats representing m thetas;
+    th0 - a 1 by m array of the corresponding m theta_0s, or a single number
+          for m == 1;
+    num_workers - the number of processes, the number of CPUs by default.
+
+  Returns an m by n array of signed distances.
+  """
+  return _run_parallel('signed_dist', x, None, th, th0, num_workers)
+
+def positive_parallel(x, th, th0, num_workers=None):
+  """Calculates the same signs as positive using a pool of processes.
+
+  Parameters:
+    x - a d by n array of floats (representing n data points in d dimensions);
+    th - a d by m array of floats representing m thetas;
+    th0 - a 1 by m array of the corresponding m theta_0s, or a single number
+          for m == 1;
+    num_workers - the number of processes, the number of CPUs by default.
+
+  Returns an m by n array of signs.
+  """
+  return _run_parallel('positive', x, None, th, th0, num_workers)
+
+def _run_parallel(func_name, data, labels, th, th0, num_workers,
+                  mem_budget=DEFAULT_MEM_BUDGET):
+  """Runs a hyperplane function over candidate shards in a process pool.
+
+  Parameters:
+    func_name - which function to run: 'score', 'signed_dist' or 'positive';
+    data, labels, th, th0 - the arguments of the function, labels are ignored
+                            (may be None) for all but 'score';
+    num_workers - the number of processes, the number of CPUs by default;
+    mem_budget - the tile budget for 'score' (see score_blocked).
+
+  The data, the labels and the candidates are placed in shared memory once.
+  Every worker gets only a range of candidates and reads its shard in place.
+  The scores are merged in the parent, the m by n results of the other
+  functions are written by the workers directly into a shared output array.
+  """
+  m = th.shape[1]
+  if m == 0:
+    # There are no candidate shards to run (and no results to concatenate).
+    if func_name == 'score':
+      return score(data, labels, th, th0)
+    func = signed_dist if func_name == 'signed_dist' else positive
+    return func(data, th, th0)
+  n = data.shape[1]
+  num_workers = num_workers or os.cpu_count()
+  th0 = np.broadcast_to(np.reshape(th0, (1, -1)), (1, m))
+  # A few shards per worker even out the load.
+  bounds = np.linspace(0, m, min(m, 4 * num_workers) + 1).astype(int)
+
+  arrays = {'data': data, 'th': th, 'th0': th0}
+  if func_name == 'score':
+    arrays['labels'] = labels
+  else:
+    arrays['out'] = np.empty((m, n))
+  blocks = {}
+  try:
+    for key, array in arrays.items():
+      blocks[key] = SharedArray.create(array, copy=(key != 'out'))
+    descriptors = {key: block.descriptor for key, block in blocks.items()}
+    with ProcessPoolExecutor(num_workers) as executor:
+      futures = [executor.submit(_parallel_shard, func_name, descriptors,
+                                 start, end, mem_budget)
+                 for start, end in zip(bounds[:-1], bounds[1:])]
+      results = [future.result() for future in futures]
+    if func_name == 'score':
+      return np.concatenate(results)
+    return blocks['out'].array.copy()
+  finally:
+    for block in blocks.values():
+      block.release(unlink=True)
+
+def _parallel_shard(func_name, descriptors, start, end, mem_budget):
+  """Worker side of _run_parallel: processes candidates in [start, end)."""
+  blocks = {key: SharedArray.attach(descriptor)
+            for key, descriptor in descriptors.items()}
+  try:
+    data = blocks['data'].array
+    th = blocks['th'].array[:, start:end]
+    th0 = blocks['th0'].array[:, start:end]
+    if func_name == 'score':
+      return score_blocked(data, blocks['labels'].array, th, th0, mem_budget)
+    func = signed_dist if func_name == 'signed_dist' else positive
+    blocks['out'].array[start:end, :] = func(data, th, th0)
+    return None
+  finally:
+    data = th = th0 = None
+    for block in blocks.values():
+      block.release(unlink=False)
+
+class SharedArray:
+  """A numpy array that lives in a shared memory block.
+
+  The descriptor (name, shape, dtype, order) is enough to attach to the same
+  array from another process without copying it.
+  """
+
+  def __init__(self, shm, shape, dtype, order='C'):
+    self.shm = shm
+    self.order = order
+    self.array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, order=order)
+
+  @classmethod
+  def create(cls, array, copy=True, order=None, dtype=None):
+    """Allocates a shared block of the array size, optionally copying it.
+
+    The block is C-ordered ('C') or Fortran-ordered ('F'), by default it keeps
+    the order of a Fortran-ordered array, so that the shared copy gives the
+    same floating point results as the array itself. With dtype the copy is
+    converted to it.
+    """
+    array = np.asarray(array)
+    dtype = np.dtype(dtype or array.dtype)
+    if order is None:
+      order = 'F' if array.flags.f_contiguous and \
+                     not array.flags.c_contiguous else 'C'
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=max(1, array.size * dtype.itemsize))
+    shared = cls(shm, array.shape, dtype, order)
+    if copy:
+      shared.array[...] = array
+    return shared
+
+  @classmethod
+  def attach(cls, descriptor):
+    """Attaches to a block created by another process."""
+    name, shape, dtype, order = descriptor
+    return cls(shared_memory.SharedMemory(name=name), shape, dtype, order)
+
+  @property
+  def descriptor(self):
+    return (self.shm.name, self.array.shape, self.array.dtype.str, self.order)
+
+  def release(self, unlink):
+    """Drops the array and closes (and optionally destroys) the block."""
+    self.array = None
+    self.shm.close()
+    if unlink:
+      self.shm.unlink()
+
 def _dumb_test():
   data = np.array([[ 1.0, 0.0, -1.5],
                    [-1.0, 1.0, -1.0]])
@@ -74,5 +511,120 @@ def _dumb_test():
     print("Expected separator:")
     print(expected_separator)
 
+def _blocked_score_test():
+  rng = np.random.default_rng(0)
+  data = rng.standard_normal((3, 1000))
+  labels = np.sign(rng.standard_normal((1, 1000)))
+  ths = rng.standard_normal((3, 50))
+  th0s = rng.standard_normal((1, 50))
+
+  expected_score = score(data, labels, ths, th0s)
+  # A tiny budget forces tiles of a few entries each.
+  test_score = score_blocked(data, labels, ths, th0s, mem_budget=64)
+  if (test_score != expected_score).any():
+    print("Wrong blocked score.")
+  test_score = score_blocked(data, labels, ths, th0s)
+  if (test_score != expected_score).any():
+    print("Wrong blocked score for the default budget.")
+
+def _empty_score_test():
+  rng = np.random.default_rng(0)
+  data = rng.standard_normal((3, 10))
+  labels = np.sign(rng.standard_normal((1, 10)))
+  ths = rng.standard_normal((3, 4))
+  th0s = rng.standard_normal((1, 4))
+
+  for func in (score_blocked, score_packed):
+    if (func(data, labels, ths[:, :0], th0s[:, :0]) !=
+        score(data, labels, ths[:, :0], th0s[:, :0])).any() or \
+       (func(data[:, :0], labels[:, :0], ths, th0s) !=
+        score(data[:, :0], labels[:, :0], ths, th0s)).any() or \
+       func(data[:, :0], labels[:, :0], ths, th0s).shape != (4,):
+      print("Wrong {f} for empty inputs.".format(f=func.__name__))
+
+def _parallel_test():
+  rng = np.random.default_rng(0)
+  data = rng.standard_normal((3, 500))
+  labels = np.sign(rng.standard_normal((1, 500)))
+  ths = rng.standard_normal((3, 40))
+  th0s = rng.standard_normal((1, 40))
+
+  if (score_parallel(data, labels, ths, th0s, num_workers=2) !=
+      score(data, labels, ths, th0s)).any():
+    print("Wrong parallel score.")
+  if (signed_dist_parallel(data, ths, th0s, num_workers=2) !=
+      signed_dist(data, ths, th0s)).any():
+    print("Wrong parallel signed distances.")
+  if (positive_parallel(data, ths, th0s, num_workers=2) !=
+      positive(data, ths, th0s)).any():
+    print("Wrong parallel signs.")
+  if score_parallel(data, labels, ths[:, :0], th0s[:, :0]).shape != (0,) or \
+     signed_dist_parallel(data, ths[:, :0], th0s[:, :0]).shape != (0, 500):
+    print("Wrong parallel results without candidates.")
+
+def _packed_score_test():
+  rng = np.random.default_rng(0)
+  data = rng.standard_normal((3, 1001))
+  labels = np.sign(rng.standard_normal((1, 1001)))
+  ths = rng.standard_normal((3, 50))
+  th0s = rng.standard_normal((1, 50))
+  # A point on a hyperplane agrees with no label.
+  data[:, 0] = 0.0
+  th0s[0, 0] = 0.0
+
+  expected_score = score(data, labels, ths, th0s)
+  if (score_packed(data, labels, ths, th0s, mem_budget=256) !=
+      expected_score).any():
+    print("Wrong packed score.")
+  if (score_packed(data, labels, ths, th0s) != expected_score).any():
+    print("Wrong packed score for the default budget.")
+
+def _hyperplane_set_test():
+  rng = np.random.default_rng(0)
+  data = rng.standard_normal((3, 100))
+  ths = rng.standard_normal((3, 5))
+  th0s = rng.standard_normal((1, 5))
+  planes = HyperplaneSet(ths, th0s)
+
+  if (planes.positive(data) != positive(data, ths, th0s)).any():
+    print("Wrong hyperplane set signs.")
+  if not np.allclose(planes.signed_dist(data), signed_dist(data, ths, th0s)):
+    print("Wrong hyperplane set signed distances.")
+
+def _racing_test():
+  rng = np.random.default_rng(0)
+  data = rng.standard_normal((2, 20000))
+  labels = np.sign(np.dot(np.array([[1.0, -2.0]]), data) + 0.3)
+  ths = rng.standard_normal((2, 200))
+  th0s = rng.standard_normal((1, 200))
+  ths[:, 17:18] = np.array([[1.0], [-2.0]])
+  th0s[0, 17] = 0.3
+
+  expected_separator = best_separator(data, labels, ths, th0s)
+  th, th0, saved = best_separator_racing(data, labels, ths, th0s, seed=0)
+  print("Racing saved {s} point evaluations.".format(s=saved))
+  if (th != expected_separator[0]).any() or \
+     (th0 != expected_separator[1]).any():
+    print("Wrong racing separator.")
+
+  small_data = rng.standard_normal((3, 50))
+  small_labels = np.sign(rng.standard_normal((1, 50)))
+  small_ths = rng.standard_normal((3, 5))
+  small_th0s = rng.standard_normal((1, 5))
+  expected_separator = best_separator(small_data, small_labels, small_ths,
+                                      small_th0s)
+  th, th0, saved = best_separator_racing(small_data, small_labels, small_ths,
+                                         small_th0s, initial_sample=10,
+                                         seed=0)
+  if saved < 0 or (th != expected_separator[0]).any() or \
+     (th0 != expected_separator[1]).any():
+    print("Wrong racing on a small data set: saved {s}.".format(s=saved))
+
 if __name__ == "__main__":
   _dumb_test()
+  _blocked_score_test()
+  _packed_score_test()
+  _empty_score_test()
+  _hyperplane_set_test()
+  _racing_test()
+  _parallel_test()
@@ -16,22 +16,81 @@ this program. If not, see <http://www.gnu.org/licenses/>.
 
 import linseptools as lst
 import argparse
+import sys
 
 def main():
   args = parse_args()
-  points, labels, theta, theta_0 = lst.generate_input(2, args.num_points,
-                                                      args.through_origin)
-  lst.draw(points, labels, (theta, theta_0))
+  if not args.output:
+    points, labels, theta, theta_0 = lst.generate_input(args.dims,
+                                                        args.num_points,
+                                                        args.through_origin)
+    if args.dims == 2:
+      lst.draw(points, labels, (theta, theta_0))
+    return
+
+  try:
+    theta, theta_0 = lst.generate_input_file(args.output, args.dims,
+                                             args.num_points,
+                                             args.through_origin,
+                                             chunk_size=args.chunk_size,
+                                             seed=args.seed,
+                                             margin=args.margin,
+                                             label_noise=args.label_noise,
+                                             num_workers=args.workers)
+  except ValueError as error:
+    sys.exit('The data can not be generated: {e}'.format(e=error))
+  print('{n} {d}D points are written to {f}.'.format(n=args.num_points,
+                                                     d=args.dims,
+                                                     f=args.output))
+  print('  theta=\n{th},'.format(th=theta))
+  print('  theta_0={th0}.'.format(th0=theta_0))
 
 def parse_args():
   parser = argparse.ArgumentParser(description='I will generate linearly '
                                                'separable data for you.')
   parser.add_argument('num_points', metavar='N', type=int, default=100,
                       nargs='?', help='The number of points to generate')
+  parser.add_argument('--dims', '-d', metavar='D', type=int, default=2,
+                      help='the number of dimensions, the data is drawn only '
+                           'for 2D')
   parser.add_argument('--through-origin', action='store_true',
                       help='Generate separable through origin data and use '
                            '"through origin" mode of an algorithm')
-  return parser.parse_args()
+  parser.add_argument('--output', '-o', metavar='filename.npy', default='',
+                      help='write the data chunk by chunk to a .npy file '
+                           'instead of drawing it')
+  parser.add_argument('--chunk-size', metavar='C', type=int,
+                      default=lst.DEFAULT_CHUNK_SIZE,
+                      help='the number of points generated at once (with '
+                           '--output only)')
+  parser.add_argument('--seed', type=int, default=None,
+                      help='random seed, the output is reproducible for the '
+                           'same seed and chunk size (with --output only)')
+  parser.add_argument('--margin', type=float, default=0.0,
+                      help='the minimal distance from a point to the separator '
+                           '(with --output only)')
+  parser.add_argument('--label-noise', type=float, default=0.0,
+                      help='the probability of flipping a label (with '
+                           '--output only)')
+  parser.add_argument('--workers', metavar='W', type=int, default=1,
+                      help='the number of processes generating the data, the '
+                           'data does not depend on it (with --output only)')
+  args = parser.parse_args()
+
+  # Checking restrictions.
+  if args.num_points < 1:
+    sys.exit('The number of points must be positive.')
+  if args.dims < 1:
+    sys.exit('The number of dimensions must be positive.')
+  if args.chunk_size < 1:
+    sys.exit('The chunk size must be positive.')
+  if args.workers < 1:
+    sys.exit('The number of workers must be positive.')
+  if args.margin < 0:
+    sys.exit('The margin must be non-negative.')
+  if not 0 <= args.label_noise <= 1:
+    sys.exit('The label noise must be a probability.')
+  return args
 
 if __name__ == "__main__":
   main()
@@ -14,8 +14,25 @@ You should have received a copy of the GNU General Public License along with
 this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+
+import struct
+import time
+import zipfile
+
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm
+
+# The default number of points generated at once by generate_input_file.
+DEFAULT_CHUNK_SIZE = 2**20
+# The number of points above which draw renders the point density.
+DEFAULT_DENSITY_THRESHOLD = 100000
+# The number of rejection rounds in a row without an accepted point after
+# which the margin is considered impossible to meet.
+_MAX_EMPTY_ROUNDS = 100
 
 def generate_input(num_dims, num_points, through_origin,
                    dist_func = lambda x : x):
@@ -51,22 +68,416 @@ def generate_input(num_dims, num_points, through_origin,
 
   return (points, labels, theta, theta_0)
 
-def draw(points, labels, equation):
+def generate_input_rng(rng, num_dims, num_points, through_origin, margin=0.0,
+                       label_noise=0.0, dist_func=None):
+  """Randomly generates an input for a linear separator from a generator.
+
+  Unlike generate_input it does not touch the global numpy random state, so
+  independent inputs can be generated in parallel from spawned seeds.
+
+  Parameters:
+    rng - np.random.Generator to use;
+    num_dims, num_points, through_origin - see generate_input;
+    margin, label_noise, dist_func - see generate_input_file.
+  Raises ValueError when the margin can not be met (see _generate_chunk).
+  Result:
+    The same as of generate_input but theta_0 is a number.
+  """
+  if dist_func is None:
+    dist_func = _identity
+  theta, theta_0 = _generate_plane(rng, num_dims, through_origin, dist_func)
+  data = np.empty((num_dims + 1, num_points))
+  _generate_chunk(rng, data, theta, theta_0, margin, label_noise, dist_func)
+  return (data[0:-1, :], data[-1:, :], theta, theta_0)
+
+def generate_input_file(filename, num_dims, num_points, through_origin,
+                        chunk_size=DEFAULT_CHUNK_SIZE, seed=None, margin=0.0,
+                        label_noise=0.0, dist_func=None, num_workers=1):
+  """Randomly generates an input for a linear separator straight into a file.
+
+  Parameters:
+    filename - the name of the .npy file to write;
+    num_dims - the number of dimensions;
+    num_points - the number of points to produce;
+    through_origin - whether the separator must go through origin;
+    chunk_size - the number of points generated at once;
+    seed - a seed for np.random.SeedSequence, the output is reproducible for a
+           fixed seed and chunk size;
+    margin - the minimal distance from a point to the separator;
+    label_noise - the probability of flipping a label;
+    dist_func - distribution function, it takes real values in [0, 1) range or
+                arrays of those values and returns a corresponding value with a
+                different distribution; does not change the distribution by
+                default; it must be picklable when num_workers > 1;
+    num_workers - the number of processes generating the chunks.
+  The points are generated chunk by chunk, every chunk from its own random
+  stream, and written to a memory-mapped .npy file, so only a chunk is held in
+  RAM at a time. The file holds a [num_points x num_dims + 1] array: a point
+  per row with its label in the last column (see load_input_file). The learners
+  train on such rows in place, the file is never copied into memory.
+  With several workers every worker fills disjoint ranges of chunks of the
+  same file. The streams are spawned per chunk, not per worker, so the file is
+  the same whatever the number of workers is.
+  Raises ValueError when the margin can not be met (see _generate_chunk).
+  Result:
+    theta (numpy [num_dims x 1] array) and theta_0 (a number) that define the
+    chosen separator.
+  """
+  if dist_func is None:
+    dist_func = _identity
+  plane_seed, data_seed = np.random.SeedSequence(seed).spawn(2)
+  theta, theta_0 = _generate_plane(np.random.default_rng(plane_seed),
+                                   num_dims, through_origin, dist_func)
+
+  output = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64,
+                                     shape=(num_points, num_dims + 1))
+  num_chunks = (num_points + chunk_size - 1) // chunk_size
+  chunk_seeds = data_seed.spawn(num_chunks)
+  chunk_params = (chunk_size, theta, theta_0, margin, label_noise, dist_func)
+  if num_workers <= 1:
+    _generate_chunks(output.T, 0, chunk_seeds, *chunk_params)
+    output.flush()
+    del output
+    return (theta, theta_0)
+
+  # The header is written, the workers map the same file.
+  output.flush()
+  del output
+  # A few tasks per worker even out the load.
+  bounds = np.linspace(0, num_chunks,
+                       min(num_chunks, 4 * num_workers) + 1).astype(int)
+  with ProcessPoolExecutor(num_workers) as executor:
+    futures = [executor.submit(_generate_file_chunks, filename, first,
+                               chunk_seeds[first:last], *chunk_params)
+               for first, last in zip(bounds[:-1], bounds[1:])]
+    for future in futures:
+      future.result()
+  return (theta, theta_0)
+
+def load_input_file(filename):
+  """Maps the input written by generate_input_file into memory.
+
+  Parameters:
+    filename - the name of the .npy file.
+  Nothing is read until it is accessed.
+  Result:
+    Points (numpy [num_dims x num_points] read-only memory-mapped array, a
+    transposed view of the rows of the file);
+    Labels for those points (numpy [1 x num_points] read-only memory-mapped
+    array).
+  """
+  return _split_rows(np.load(filename, mmap_mode='r'))
+
+def _split_rows(data):
+  """Splits [num_points x num_dims + 1] rows into points and labels views."""
+  return (np.transpose(data[:, 0:-1]), np.transpose(data[:, -1:]))
+
+def save_input(filename, points, labels, through_origin=False):
+  """Writes an input to a binary file.
+
+  Parameters:
+    filename - the name of the file: a .npy file holds the
+               [num_points x num_dims + 1] rows of generate_input_file, a .npz
+               file holds the same array as 'data' and the header
+               [num_dims, num_points, through_origin] as 'header';
+    points - a [num_dims x num_points] array;
+    labels - a [1 x num_points] array;
+    through_origin - whether the data is separable through origin (.npz only).
+  The .npz archive is not compressed, so that load_input can map it.
+  """
+  data = np.empty((points.shape[1], points.shape[0] + 1))
+  data[:, 0:-1] = np.transpose(points)
+  data[:, -1] = labels[0]
+  if filename.endswith('.npz'):
+    header = np.array([points.shape[0], points.shape[1], through_origin],
+                      dtype=np.int64)
+    np.savez(filename, data=data, header=header)
+  else:
+    np.save(filename, data)
+
+def load_input(filename):
+  """Maps an input written by save_input or generate_input_file into memory.
+
+  Parameters:
+    filename - the name of a .npy or .npz file.
+  The data of an uncompressed .npz archive is mapped right at its offset
+  inside the archive, a compressed one is read into memory.
+  Result:
+    Points (numpy [num_dims x num_points] read-only array);
+    Labels for those points (numpy [1 x num_points] read-only array);
+    The header, a dictionary with the dims, points and through_origin keys,
+    through_origin is None when the file does not store it.
+  """
+  if not filename.endswith('.npz'):
+    points, labels = load_input_file(filename)
+    return (points, labels, {'dims': points.shape[0],
+                             'points': points.shape[1],
+                             'through_origin': None})
+
+  with np.load(filename) as archive:
+    dims, num_points, through_origin = archive['header'].tolist()
+  data = _map_npz_member(filename, 'data.npy')
+  if data is None:
+    with np.load(filename) as archive:
+      data = archive['data']
+  points, labels = _split_rows(data)
+  return (points, labels, {'dims': dims, 'points': num_points,
+                           'through_origin': bool(through_origin)})
+
+def _map_npz_member(filename, member):
+  """Maps an uncompressed .npy member of a .npz archive into memory.
+
+  The offset of the member data is taken from its local zip header, the
+  central directory copy of the extra field may differ.
+  Result:
+    A read-only memory-mapped array or None if the member is compressed.
+  """
+  with zipfile.ZipFile(filename) as archive:
+    info = archive.getinfo(member)
+  if info.compress_type != zipfile.ZIP_STORED:
+    return None
+  with open(filename, 'rb') as f:
+    f.seek(info.header_offset)
+    local_header = f.read(30)
+    name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+    f.seek(info.header_offset + 30 + name_length + extra_length)
+    if np.lib.format.read_magic(f) == (1, 0):
+      read_header = np.lib.format.read_array_header_1_0
+    else:
+      read_header = np.lib.format.read_array_header_2_0
+    shape, fortran_order, dtype = read_header(f)
+    offset = f.tell()
+  return np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                   shape=shape, order='F' if fortran_order else 'C')
+
+def iterate_chunks(points, labels, chunk_size=DEFAULT_CHUNK_SIZE):
+  """Iterates over the points and the labels in chunks of columns.
+
+  Parameters:
+    points - a [num_dims x num_points] array, e.g. from load_input_file;
+    labels - a [1 x num_points] array;
+    chunk_size - the maximal number of points in a chunk.
+  The chunks are views, so a memory-mapped file is read only chunk by chunk.
+  Yields the tuples (points, labels) of [num_dims x chunk] and [1 x chunk]
+  arrays.
+  """
+  for start in range(0, points.shape[1], chunk_size):
+    yield (points[:, start:start + chunk_size],
+           labels[:, start:start + chunk_size])
+
+def _identity(x):
+  return x
+
+def _generate_plane(rng, num_dims, through_origin, dist_func):
+  """Randomly chooses a separator the same way generate_input does.
+
+  Parameters:
+    rng - np.random.Generator to use;
+    num_dims - the number of dimensions;
+    through_origin - whether the separator must go through origin;
+    dist_func - distribution function (see generate_input_file).
+  Result:
+    theta (numpy [num_dims x 1] array) and theta_0 (a number).
+  """
+  theta = rng.random(num_dims) - 0.5
+  if through_origin:
+    point_on_plane = np.zeros(num_dims)
+  else:
+    point_on_plane = dist_func(rng.random(num_dims))
+  theta_0 = -np.dot(theta, point_on_plane)
+  return (np.transpose(np.array([theta])), theta_0)
+
+def _generate_file_chunks(filename, first_chunk, chunk_seeds, *chunk_params):
+  """Worker side of generate_input_file: fills chunks of the mapped file."""
+  output = np.load(filename, mmap_mode='r+')
+  _generate_chunks(output.T, first_chunk, chunk_seeds, *chunk_params)
+  output.flush()
+
+def _generate_chunks(output, first_chunk, chunk_seeds, chunk_size, theta,
+                     theta_0, margin, label_noise, dist_func):
+  """Fills consecutive chunks of the output.
+
+  Parameters:
+    output - [num_dims + 1 x num_points] array (or a transposed view of the
+             file rows) to fill;
+    first_chunk - the index of the first chunk to fill;
+    chunk_seeds - np.random.SeedSequence for every chunk to fill;
+    chunk_size - the number of points in a chunk;
+    the rest - see _generate_chunk.
+  """
+  num_points = output.shape[1]
+  for idx, chunk_seed in enumerate(chunk_seeds, first_chunk):
+    start = idx * chunk_size
+    end = min(start + chunk_size, num_points)
+    _generate_chunk(np.random.default_rng(chunk_seed), output[:, start:end],
+                    theta, theta_0, margin, label_noise, dist_func)
+
+def _generate_chunk(rng, output, theta, theta_0, margin, label_noise,
+                    dist_func):
+  """Fills a chunk of labelled points.
+
+  Parameters:
+    rng - np.random.Generator to use;
+    output - [num_dims + 1 x chunk size] array to fill, the labels go to the
+             last row;
+    theta, theta_0 - the separator;
+    margin - the minimal distance from a point to the separator, the points
+             closer to the separator are rejected and generated again;
+    label_noise - the probability of flipping a label;
+    dist_func - distribution function (see generate_input_file).
+  Raises ValueError when _MAX_EMPTY_ROUNDS rounds in a row accept no point,
+  i.e. the margin can not be met (practically) within the distribution.
+  """
+  num_dims, size = output.shape[0] - 1, output.shape[1]
+  min_value = margin * np.linalg.norm(theta)
+  filled = 0
+  empty_rounds = 0
+  while filled < size:
+    points = dist_func(rng.random((num_dims, size - filled)))
+    values = np.dot(np.transpose(theta), points)[0] + theta_0
+    accepted = np.abs(values) >= min_value
+    num_accepted = np.count_nonzero(accepted)
+    empty_rounds = 0 if num_accepted else empty_rounds + 1
+    if empty_rounds == _MAX_EMPTY_ROUNDS:
+      raise ValueError('No point is at least {m} away from the separator.'
+                       .format(m=margin))
+    output[0:-1, filled:filled + num_accepted] = points[:, accepted]
+    output[-1, filled:filled + num_accepted] = np.sign(values[accepted])
+    filled += num_accepted
+  if label_noise > 0:
+    flipped = rng.random(size) < label_noise
+    output[-1, flipped] = -output[-1, flipped]
+
+def draw(points, labels, equation,
+         density_threshold=DEFAULT_DENSITY_THRESHOLD, bins=256):
   """Draws the provided points and separator.
 
   Parameters:
     points - 2 x N matrix, only 2D case is supported;
     labels - 1 x N matrix, labels for the provided points: +1 or -1;
-    equation - a tuple of equation parameters: (theta, theta_0).
+    equation - a tuple of equation parameters: (theta, theta_0), or (thetas,
+               theta_0s) where thetas is a 2 x m matrix and theta_0s is 1 x m
+               matrix to draw m separators at once;
+    density_threshold - the number of points above which the density of
+                        positive and negative points is drawn instead of the
+                        points themselves;
+    bins - the number of density bins along every axis.
   """
   axes = plt.subplot(111)
   axes.set_aspect('equal')
 
-  _draw_points(points, labels)
   min_point, max_point, epsilon = _calculate_points_properties(points)
+  if points.shape[1] > density_threshold:
+    _draw_density(points, labels, min_point, max_point, bins)
+  else:
+    _draw_points(points, labels)
   _draw_line(equation, min_point, max_point, epsilon)
   plt.show()
 
+class TrainingRecorder:
+  """A perceptron hook that records the separators for an animation.
+
+  Calling the hook only copies (theta, theta_0) into a buffer, and only for
+  every k-th update that is at least min_interval seconds after the previous
+  recorded one, so the training runs at full speed. The frames are rendered
+  once the training is over (see save).
+  """
+
+  def __init__(self, every=1, min_interval=None):
+    """Creates an empty recorder.
+
+    Parameters:
+      every - record every k-th update only;
+      min_interval - either None or the minimal number of seconds between the
+                     recorded updates.
+    """
+    self.every = every
+    self.min_interval = min_interval
+    self._num_calls = 0
+    self._last_time = None
+    self._thetas = []
+    self._theta_0s = []
+    self._steps = []
+
+  def __call__(self, params):
+    """The hook itself: takes the tuple (th, th0)."""
+    self._num_calls += 1
+    if (self._num_calls - 1) % self.every:
+      return
+    if self.min_interval is not None:
+      now = time.perf_counter()
+      if self._last_time is not None and \
+         now - self._last_time < self.min_interval:
+        return
+      self._last_time = now
+    self._record(params)
+
+  @property
+  def num_frames(self):
+    """The number of the recorded separators.
+
+    It is not __len__ on purpose: the learners check the hook with "if hook",
+    an empty recorder must not be falsy.
+    """
+    return len(self._steps)
+
+  def finish(self, params):
+    """Records the separator (th, th0) the learner returned as the last frame.
+
+    It is recorded even right after a recorded update, the separator of the
+    averaged perceptron is not the one of its last update.
+    """
+    self._record(params)
+
+  def save(self, filename, points, labels, fps=10,
+           density_threshold=DEFAULT_DENSITY_THRESHOLD, bins=256):
+    """Renders the recorded separators into a video or a GIF.
+
+    Parameters:
+      filename - the name of the output file, .gif files are written with
+                 Pillow, the others - with the default matplotlib writer
+                 (ffmpeg);
+      points - 2 x N matrix, only 2D case is supported;
+      labels - 1 x N matrix, labels for the provided points: +1 or -1;
+      fps - frames per second;
+      density_threshold, bins - see draw.
+    The points are drawn once, the box crossings of all the frames are
+    calculated in a single pass, every frame only moves the separator line.
+    """
+    figure = plt.figure()
+    axes = figure.add_subplot(111)
+    axes.set_aspect('equal')
+    min_point, max_point, epsilon = _calculate_points_properties(points)
+    if points.shape[1] > density_threshold:
+      _draw_density(points, labels, min_point, max_point, bins)
+    else:
+      _draw_points(points, labels)
+
+    equation = (np.transpose(np.array(self._thetas)),
+                np.array([self._theta_0s]))
+    polylines, found = _separator_polylines(equation, min_point, max_point,
+                                            epsilon)
+    line, = axes.plot([], [], 'b-')
+
+    def update(frame):
+      if found[frame]:
+        line.set_data(polylines[frame, :, 0], polylines[frame, :, 1])
+      else:
+        line.set_data([], [])
+      axes.set_title('update {u}'.format(u=self._steps[frame]))
+      return (line,)
+
+    animation = FuncAnimation(figure, update, frames=self.num_frames)
+    animation.save(filename, writer='pillow' if filename.endswith('.gif')
+                                     else None, fps=fps)
+    plt.close(figure)
+
+  def _record(self, params):
+    theta, theta_0 = params
+    self._thetas.append(np.array(theta, dtype=np.float64).ravel())
+    self._theta_0s.append(float(np.squeeze(theta_0)))
+    self._steps.append(self._num_calls)
+
 def _calculate_points_properties(points):
   """Calculates some properties of the provided points.
 
@@ -109,45 +520,113 @@ def _draw_points(points, labels):
   plt.plot(pos_points[0], pos_points[1], 'k+')
   plt.plot(neg_points[0], neg_points[1], 'k_')
 
+def _draw_density(points, labels, min_point, max_point, bins,
+                  chunk_size=DEFAULT_CHUNK_SIZE):
+  """Draws the density of the provided points.
+
+  Parameters:
+    points - 2 x N matrix, only 2D case is supported;
+    labels - 1 x N matrix, labels for the provided points: +1 or -1;
+    min_point, max_point - diagonal points that define a "box" that contain all
+                           the points;
+    bins - the number of bins along every axis;
+    chunk_size - the number of points binned at once.
+  The points are binned chunk by chunk into 2D histograms, so the memory does
+  not depend on N and neither does the rendering cost. The positive points are
+  drawn in green, the negative ones - in red, as two rasterized images.
+  """
+  box_size = max_point - min_point
+  # Keep the bins valid for the degenerate boxes.
+  box_size[box_size == 0] = 1.0
+  edges = [np.linspace(min_point[i, 0], min_point[i, 0] + box_size[i, 0],
+                       bins + 1) for i in range(2)]
+  pos_counts = np.zeros((bins, bins))
+  neg_counts = np.zeros((bins, bins))
+  num_points = points.shape[1]
+  for start in range(0, num_points, chunk_size):
+    chunk = np.asarray(points[:, start:start + chunk_size])
+    positive = np.asarray(labels[0, start:start + chunk_size]) > 0
+    pos_counts += np.histogram2d(chunk[0, positive], chunk[1, positive],
+                                 bins=edges)[0]
+    neg_counts += np.histogram2d(chunk[0, ~positive], chunk[1, ~positive],
+                                 bins=edges)[0]
+
+  extent = (edges[0][0], edges[0][-1], edges[1][0], edges[1][-1])
+  for counts, cmap in ((neg_counts, 'Reds'), (pos_counts, 'Greens')):
+    if not counts.any():
+      continue
+    # The histogram is indexed by (x, y), images - by (row, column).
+    plt.imshow(np.ma.masked_equal(np.transpose(counts), 0), origin='lower',
+               extent=extent, cmap=cmap, norm=LogNorm(), alpha=0.7,
+               interpolation='nearest')
+
 def _draw_line(equation, min_point, max_point, epsilon):
-  """Draw the line defined by the equation.
+  """Draw the lines defined by the equation.
 
   Parameters:
-    equation - a tuple of equation parameters: (theta, theta_0).
+    equation - a tuple of equation parameters: (theta, theta_0), or (thetas,
+               theta_0s) where thetas is a 2 x m matrix and theta_0s is 1 x m
+               matrix to draw m lines at once.
     min_point, max_point - diagonal points that define a "box" in which the line
                            should be drawn;
     epsilon - allowed linear calculation error: if the distance between 2 points
               is less than epsilon, they are equal.
-  The algorithm defines 2 points where the provided line crosses the borders of
-  the box in which it should be drawn. The line is drawn between those 2 points.
-  There is an augment in the middle of the line that shows the direction of the
-  normal.
+  The lines are drawn as a single collection (see _separator_polylines).
   """
-  line_points = _define_box_crossing(equation, min_point, max_point, epsilon)
+  polylines, found = _separator_polylines(equation, min_point, max_point,
+                                          epsilon)
 
   # No intersection, hence nothing to draw.
-  if line_points.shape[1] == 0:
+  if not found.any():
     return
 
-  medium = (line_points[:, 0:1] + line_points[:, 1:2]) / 2
-  scaled_theta = _scale_vector_for_box(equation[0], max_point - min_point)
-  theta_tip = medium + scaled_theta
-  line_points = np.concatenate((line_points[:, 0:1], medium, theta_tip, medium,
-                                line_points[:, 1:2]), axis=1)
-  plt.plot(line_points[0], line_points[1], 'b-')
+  axes = plt.gca()
+  axes.add_collection(LineCollection(polylines[found], colors='b'))
+  axes.autoscale_view()
+
+def _separator_polylines(equation, min_point, max_point, epsilon):
+  """Calculates the polylines that depict the lines defined by the equation.
+
+  Parameters:
+    equation - a tuple of equation parameters: (thetas, theta_0s), where thetas
+               is a 2 x m matrix and theta_0s is 1 x m matrix;
+    min_point, max_point - diagonal points that define a "box" in which the
+                           lines should be drawn;
+    epsilon - allowed linear calculation error: if the distance between 2 points
+              is less than epsilon, they are equal.
+  The algorithm defines 2 points where every provided line crosses the borders
+  of the box in which it should be drawn. The line is drawn between those 2
+  points. There is an augment in the middle of the line that shows the
+  direction of the normal.
+  Result:
+    polylines - m x 5 x 2 array, every polyline goes through the start, the
+                medium, the normal tip, the medium and the end of a line;
+    found - a boolean array of m elements, whether a line crosses the box (the
+            other polylines are meaningless).
+  """
+  thetas, theta_0s = equation
+  starts, ends, found = _define_box_crossings(thetas, theta_0s, min_point,
+                                              max_point, epsilon)
+  medium = (starts + ends) / 2
+  with np.errstate(divide='ignore', invalid='ignore'):
+    scaled_thetas = _scale_vector_for_box(thetas, max_point - min_point)
+  theta_tips = medium + scaled_thetas
+  polylines = np.stack((starts, medium, theta_tips, medium, ends))
+  return (np.transpose(polylines, (2, 0, 1)), found)
 
 def _scale_vector_for_box(vec, box_size, factor=10):
-  """Scales the vector to match the box size.
+  """Scales the vectors to match the box size.
 
   Parameters:
-    vec - the provided column vector to be scaled;
+    vec - the provided column vector (or a matrix of column vectors) to be
+          scaled;
     box_size - a column vector that defines the box size;
     factor - what fraction of the box diagonal should the scaled vector be
              equal to (norm(scaled_vec) == norm(box_size) / factor).
   The scaled vector is returned.
   """
   desired_norm = np.linalg.norm(box_size) / factor
-  current_norm = np.linalg.norm(vec)
+  current_norm = np.linalg.norm(vec, axis=0, keepdims=True)
   return vec * (desired_norm / current_norm)
 
 def _define_box_crossing(equation, min_point, max_point, epsilon):
@@ -163,102 +642,24 @@ def _define_box_crossing(equation, min_point, max_point, epsilon):
                            |------------->
     epsilon - allowed linear calculation error: if the distance between 2 points
               is less than epsilon, they are equal.
-  The algorithm defines 2 points where the provided line crosses the borders of
-  the box. The horizontal and vertical degenerated cases considered at first and
-  separately. The main part of algorithm goes through the 4 box borders and
-  finds which of them are crossed by the line.
-  """
-  theta, theta_0 = equation
-  box_size = max_point - min_point
-
-  # Horizontal and vertical degenerate cases.
-  for i in range(2):
-    if _has_zero_coordinate(theta, box_size, epsilon, zero_axis=i):
-      return _define_degenerate_box_crossin(equation, min_point, max_point,
-                                            epsilon, zero_axis=i)
-
-  result = np.array([[], []])
-
-  # FIXME: Consider a case whith crossing in the corner. The current algorithm
-  #        will add the same point twice in this case.
-  # Left (minimal) vertical (along x2) border:
-  x = min_point[0, 0]
-  candidate = np.array([[x],
-                        [_get_other_coordinate(equation, x, given_axis=0)]])
-  if candidate[1, 0] > min_point[1, 0] - epsilon and \
-     candidate[1, 0] < max_point[1, 0] + epsilon:
-     result = np.concatenate((result, candidate), axis=1)
-
-  # Top (maximal) horizontal (along x1) border:
-  x = max_point[1, 0]
-  candidate = np.array([[_get_other_coordinate(equation, x, given_axis=1)],
-                        [x]])
-  if candidate[0, 0] > min_point[0, 0] - epsilon and \
-     candidate[0, 0] < max_point[0, 0] + epsilon:
-     result = np.concatenate((result, candidate), axis=1)
-
-  # Right (maximal) vertical (along x2) border:
-  x = max_point[0, 0]
-  candidate = np.array([[x],
-                        [_get_other_coordinate(equation, x, given_axis=0)]])
-  if candidate[1, 0] > min_point[1, 0] - epsilon and \
-     candidate[1, 0] < max_point[1, 0] + epsilon:
-     result = np.concatenate((result, candidate), axis=1)
-
-  # Bottom (minimal) horizontal (along x1) border:
-  x = min_point[1, 0]
-  candidate = np.array([[_get_other_coordinate(equation, x, given_axis=1)],
-                        [x]])
-  if candidate[0, 0] > min_point[0, 0] - epsilon and \
-     candidate[0, 0] < max_point[0, 0] + epsilon:
-     result = np.concatenate((result, candidate), axis=1)
-
-  assert result.shape[1] == 2 or result.shape[1] == 0, \
-         "Must have found no or 2 intersections"
-  return result
-
-def _get_other_coordinate(equation, x, given_axis):
-  """Given a coordinate of a point on the line calculates the other coordinate.
-
-  Parameters:
-    equation - a tuple of equation parameters: (theta, theta_0);
-    x - the given coordinate;
-    given_axis - the axis of the given coordinate.
-  Only 2D case is considered.
-  The other coordinate is returned.
+  A single line version of _define_box_crossings.
+  Returns 2 x 2 matrix of the crossing points or 2 x 0 matrix if the line does
+  not cross the box.
   """
-  assert given_axis == 0 or given_axis == 1, "only 2D case is considered"
-  other_axis = 1 - given_axis
   theta, theta_0 = equation
-  return -(theta[given_axis, 0] * x + theta_0) / theta[other_axis, 0]
-
-def _has_zero_coordinate(point, box_size, epsilon, zero_axis):
-  """Checks that one of point's coordinates is close to zero.
+  starts, ends, found = _define_box_crossings(theta, theta_0, min_point,
+                                              max_point, epsilon)
+  if not found[0]:
+    return np.array([[], []])
+  return np.concatenate((starts, ends), axis=1)
 
-  Parameters:
-    point - 2D point represented as a column vector;
-    box_size - size of the viewed box;
-    epsilon - allowed linear calculation error: if the distance between 2 points
-              is less than epsilon, they are equal;
-    zero_axis - the axis along which the point is expected to have zero
-                coordinate.
-  Box size with epsilon give understanding of the minimal distinguishable angle.
-  """
-  assert zero_axis == 0 or zero_axis == 1, "only 2D case is considered"
-  other_axis = 1 - zero_axis
-  if point[other_axis, 0] == 0:
-    return False
-  point_ratio = abs(point[zero_axis, 0] / point[other_axis, 0])
-  epsilon_ratio = epsilon / box_size[other_axis, 0]
-  assert epsilon_ratio > 0
-  return point_ratio < epsilon_ratio
-
-def _define_degenerate_box_crossin(equation, min_point, max_point, epsilon,
-                                   zero_axis):
-  """Defines points of the line and the box intersection for the corner case.
+def _define_box_crossings(thetas, theta_0s, min_point, max_point, epsilon):
+  """Defines where the lines cross the box.
 
   Parameters:
-    equation - a tuple of equation parameters: (theta, theta_0);
+    thetas - 2 x m matrix, the normals of m lines;
+    theta_0s - 1 x m matrix of the offsets of the lines, or a single number for
+               m == 1;
     min_point, max_point - diagonal points that define a "box";
                            ^   |------max
                            |   |       |
@@ -266,18 +667,123 @@ def _define_degenerate_box_crossin(equation, min_point, max_point, epsilon,
                            |  min------|
                            |------------->
     epsilon - allowed linear calculation error: if the distance between 2 points
-              is less than epsilon, they are equal;
-    zero_axis - the axis along which the line normal is expected to have zero
-                coordinate.
-  The corner case is the case where the line is either horizontal or vertical.
+              is less than epsilon, they are equal.
+  The algorithm defines 2 points where every line crosses the borders of the
+  box, all the lines are processed at once. The horizontal and vertical
+  degenerated cases are the lines whose normal is so close to an axis that the
+  angle is indistinguishable in the box (the line is drawn along the box side
+  then). For the rest the crossings with the 4 box borders are calculated and
+  the most distant pair of the crossings that are within the box is chosen, so
+  a crossing in a corner is not counted twice.
+  Result:
+    starts, ends - 2 x m matrices of the crossing points;
+    found - a boolean array of m elements, whether a line crosses the box (the
+            points of the other lines are meaningless).
   """
-  other_axis = 1 - zero_axis
-  theta, theta_0 = equation
-  point = np.array([[0.0], [0.0]])
-  point[other_axis, 0] =  -theta_0 / theta[other_axis, 0]
-  # Broadcasting. Getting 2 points with the correctly set other axes.
-  points = np.dot(point, np.array([[1, 1]]))
-  # Filling zero axes.
-  points[zero_axis, 0] = min_point[zero_axis, 0]
-  points[zero_axis, 1] = max_point[zero_axis, 0]
-  return points
+  thetas = np.asarray(thetas, dtype=np.float64)
+  num_lines = thetas.shape[1]
+  theta_0s = np.broadcast_to(np.reshape(theta_0s, (1, -1)),
+                              (1, num_lines))[0]
+  box_size = max_point - min_point
+  assert epsilon / box_size[0, 0] > 0 and epsilon / box_size[1, 0] > 0
+  min_x, min_y = min_point[0, 0], min_point[1, 0]
+  max_x, max_y = max_point[0, 0], max_point[1, 0]
+  th_x, th_y = thetas[0], thetas[1]
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    # Horizontal and vertical degenerate cases.
+    horizontal = (th_y != 0) & (np.abs(th_x / th_y) < epsilon / box_size[1, 0])
+    vertical = ~horizontal & (th_x != 0) & \
+               (np.abs(th_y / th_x) < epsilon / box_size[0, 0])
+
+    # Crossings with the left, top, right and bottom borders (in this order).
+    crossings = np.empty((2, 4, num_lines))
+    crossings[0, 0], crossings[0, 2] = min_x, max_x
+    crossings[1, 0] = -(th_x * min_x + theta_0s) / th_y
+    crossings[1, 2] = -(th_x * max_x + theta_0s) / th_y
+    crossings[1, 1], crossings[1, 3] = max_y, min_y
+    crossings[0, 1] = -(th_y * max_y + theta_0s) / th_x
+    crossings[0, 3] = -(th_y * min_y + theta_0s) / th_x
+    along_y = crossings[1, 0::2]
+    along_x = crossings[0, 1::2]
+    inside = np.empty((4, num_lines), dtype=bool)
+    inside[0::2] = (along_y > min_y - epsilon) & (along_y < max_y + epsilon)
+    inside[1::2] = (along_x > min_x - epsilon) & (along_x < max_x + epsilon)
+
+    degenerate_offsets = -theta_0s / np.where(horizontal, th_y, th_x)
+
+    pairs = np.array([(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)])
+    diffs = crossings[:, pairs[:, 0]] - crossings[:, pairs[:, 1]]
+    distances = np.where(inside[pairs[:, 0]] & inside[pairs[:, 1]],
+                         np.sum(diffs * diffs, axis=0), -1.0)
+  best_pair = pairs[np.argmax(distances, axis=0)]
+  lines = np.arange(num_lines)
+  starts = crossings[:, best_pair[:, 0], lines]
+  ends = crossings[:, best_pair[:, 1], lines]
+  found = np.max(distances, axis=0) >= 0
+
+  # The degenerate lines go along the box sides.
+  starts[:, horizontal] = [[min_x], [0.0]]
+  ends[:, horizontal] = [[max_x], [0.0]]
+  starts[1, horizontal] = ends[1, horizontal] = degenerate_offsets[horizontal]
+  starts[:, vertical] = [[0.0], [min_y]]
+  ends[:, vertical] = [[0.0], [max_y]]
+  starts[0, vertical] = ends[0, vertical] = degenerate_offsets[vertical]
+  found |= horizontal | vertical
+  return (starts, ends, found)
+
+def _recorder_test():
+  import perceptron
+  points = np.array([[1.0, -1.0, 2.0, -2.0, 0.5],
+                     [1.0, -1.0, 0.5, -0.5, 2.0]])
+  labels = np.array([[1, -1, 1, -1, 1]])
+  recorder = TrainingRecorder()
+  if not recorder:
+    print("An empty recorder is falsy.")
+  mistakes = [0]
+  def counting_hook(params):
+    mistakes[0] += 1
+    recorder(params)
+  perceptron.perceptron(points, labels, {'T': 10}, counting_hook)
+  if mistakes[0] == 0 or recorder.num_frames != mistakes[0]:
+    print("Wrong number of recorded frames: {f} for {m} mistakes."
+          .format(f=recorder.num_frames, m=mistakes[0]))
+
+  recorder = TrainingRecorder()
+  perceptron.perceptron(points, labels, {'T': 10}, recorder)
+  if recorder.num_frames != mistakes[0]:
+    print("The recorder used as a hook directly missed the mistakes.")
+
+  recorder = TrainingRecorder()
+  theta, theta_0 = perceptron.averaged_perceptron(points, labels, {'T': 10},
+                                                  recorder)
+  num_updates = recorder.num_frames
+  recorder.finish((theta, theta_0))
+  if recorder.num_frames != num_updates + 1 or \
+     not np.allclose(recorder._thetas[-1], theta.ravel()) or \
+     recorder._theta_0s[-1] != float(np.squeeze(theta_0)):
+    print("The final averaged separator is not the last frame.")
+
+def _generate_input_file_test():
+  import os
+  import tempfile
+  directory = tempfile.mkdtemp()
+  contents = []
+  separators = []
+  for num_workers in (1, 3):
+    filename = os.path.join(directory, 'input{w}.npy'.format(w=num_workers))
+    separators.append(generate_input_file(filename, 3, 1000, False,
+                                          chunk_size=128, seed=0, margin=0.1,
+                                          num_workers=num_workers))
+    with open(filename, 'rb') as f:
+      contents.append(f.read())
+    os.remove(filename)
+  os.rmdir(directory)
+  if contents[0] != contents[1] or \
+     (separators[0][0] != separators[1][0]).any() or \
+     separators[0][1] != separators[1][1]:
+    print("The generated file depends on the number of workers.")
+
+if __name__ == "__main__":
+  _generate_input_file_test()
+  _recorder_test()
@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+"""A program that compares the perceptron mistakes with the theoretical bound.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import json
+import os
+import sys
+
+import linseptools as lst
+import perceptron as petron
+import numpy as np
+
+# The algorithms by their command line names. The parallel perceptron is left
+# out, the trials are already spread over the processes.
+ALGOS = {'petron': petron.perceptron,
+         'av_petron': petron.averaged_perceptron,
+         'as_petron': petron.active_set_perceptron}
+
+def main():
+  args = parse_args()
+  if args.self_test:
+    _mistake_bound_test()
+    _run_trials_test()
+    return
+  summary = run_trials(args)
+  print(json.dumps(summary, indent=2))
+
+def parse_args(argv=None):
+  parser = argparse.ArgumentParser(description='I will check the perceptron '
+                                               'mistake bound on many random '
+                                               'data sets.')
+  parser.add_argument('trials', metavar='N', type=int, default=100, nargs='?',
+                      help='the number of random data sets')
+  parser.add_argument('--algos', '-a', metavar='A', nargs='+',
+                      choices=list(ALGOS), default=['petron'],
+                      help='the algorithms to train on every data set '
+                           '(default: petron)')
+  parser.add_argument('--points', '-p', metavar='P', type=int, default=100,
+                      help='the number of points in a data set')
+  parser.add_argument('--dims', '-d', metavar='D', type=int, default=2,
+                      help='the number of dimensions')
+  parser.add_argument('--petron-iter', '-t', metavar='T', type=int,
+                      default=1000,
+                      help='the maximal number of iterations in perceptron '
+                           'algorithm')
+  parser.add_argument('--through-origin', action='store_true',
+                      help='generate separable through origin data and use '
+                           '"through origin" mode of an algorithm')
+  parser.add_argument('--margin', type=float, default=0.0,
+                      help='the minimal distance from a point to the separator')
+  parser.add_argument('--seed', type=int, default=None,
+                      help='random seed, the results are reproducible for the '
+                           'same seed')
+  parser.add_argument('--workers', metavar='W', type=int, default=None,
+                      help='the number of processes (default: the number of '
+                           'CPUs)')
+  parser.add_argument('--batch-size', metavar='B', type=int, default=None,
+                      help='the number of data sets a worker gets at once '
+                           '(default: a few batches per worker)')
+  parser.add_argument('--output', '-o', metavar='filename.jsonl',
+                      default='mistake_bounds.jsonl',
+                      help='the file the trial records are streamed to')
+  parser.add_argument('--summary', metavar='filename.json', default='',
+                      help='the file to write the aggregated results to '
+                           '(default: the output name with .summary.json)')
+  parser.add_argument('--self-test', action='store_true',
+                      help='run the self-tests of the program instead')
+  args = parser.parse_args(argv)
+
+  # Checking restrictions.
+  if args.trials < 1:
+    sys.exit('The number of trials must be positive.')
+  if args.points < 1:
+    sys.exit('The number of points must be positive.')
+  if args.dims < 1:
+    sys.exit('The number of dimensions must be positive.')
+  if args.petron_iter < 1:
+    sys.exit('The number of iterations in perceptron algorithm must be '
+             'positive.')
+  if args.margin < 0:
+    sys.exit('The margin must be non-negative.')
+  if args.workers is not None and args.workers < 1:
+    sys.exit('The number of workers must be positive.')
+  if args.batch_size is not None and args.batch_size < 1:
+    sys.exit('The batch size must be positive.')
+  if not args.summary:
+    args.summary = os.path.splitext(args.output)[0] + '.summary.json'
+  return args
+
+def run_trials(params):
+  """Runs the trials in a process pool and aggregates their results.
+
+  Every trial generates a data set from its own seed (spawned from the seed,
+  so the results do not depend on the number of workers or the batches),
+  trains all the algorithms on it and compares their mistakes with the bound
+  (see mistake_bound). The workers get batches of trials, so the start-up and
+  the imports are paid once per process. The trial records are written to
+  the output as JSON lines as soon as their batch is done.
+
+  Parameters:
+    params - a class with the required parameters: trials, algos, points,
+             dims, petron_iter, through_origin, margin, seed, workers,
+             batch_size, output, summary (see parse_args).
+  Result:
+    The summary dictionary (see _Summary), it is also written to the summary
+    file.
+  """
+  num_workers = params.workers or os.cpu_count()
+  batch_size = params.batch_size or \
+               max(1, -(-params.trials // (4 * num_workers)))
+  trial_seeds = np.random.SeedSequence(params.seed).spawn(params.trials)
+  config = {'algos': params.algos, 'points': params.points,
+            'dims': params.dims, 'T': params.petron_iter,
+            'through_origin': params.through_origin, 'margin': params.margin}
+
+  summary = _Summary(params.algos)
+  with open(params.output, 'w') as output, \
+       ProcessPoolExecutor(num_workers) as executor:
+    futures = [executor.submit(_run_batch, first,
+                               trial_seeds[first:first + batch_size], config)
+               for first in range(0, params.trials, batch_size)]
+    for future in as_completed(futures):
+      for record in future.result():
+        output.write(json.dumps(record) + '\n')
+        summary.add(record)
+      output.flush()
+
+  result = summary.result()
+  with open(params.summary, 'w') as f:
+    json.dump(result, f, indent=2)
+  return result
+
+def mistake_bound(points, labels, theta, theta_0, through_origin):
+  """Calculates the perceptron mistake bound (R / gamma)^2 for a separator.
+
+  Parameters:
+    points - a [num_dims x num_points] array;
+    labels - a [1 x num_points] array;
+    theta, theta_0 - a separator of the points;
+    through_origin - whether the perceptron runs in "through origin" mode,
+                     theta_0 must be 0 then.
+  Without the "through origin" mode the perceptron is a perceptron through
+  origin on the points extended with a constant 1 coordinate, so the radius
+  and the margin are those of the extended points and separator.
+  Result:
+    The tuple (bound, R, gamma), the bound is inf when the separator does not
+    separate the points with a positive margin.
+  """
+  extension = 0.0 if through_origin else 1.0
+  radius = np.max(np.sqrt(np.sum(points ** 2, axis=0) + extension))
+  norm = np.sqrt(np.sum(theta ** 2) + theta_0 ** 2)
+  gamma = np.min(labels * (np.dot(np.transpose(theta), points) + theta_0)) / \
+          norm
+  bound = (radius / gamma) ** 2 if gamma > 0 else np.inf
+  return (float(bound), float(radius), float(gamma))
+
+def _run_batch(first_trial, trial_seeds, config):
+  """Worker side of run_trials: runs the trials of a batch.
+
+  Result:
+    A list of the records, one per trial and algorithm.
+  """
+  algo_params = {'T': config['T'], 'through_origin': config['through_origin'],
+                 'stats': True}
+  records = []
+  for trial, trial_seed in enumerate(trial_seeds, first_trial):
+    points, labels, theta, theta_0 = lst.generate_input_rng(
+        np.random.default_rng(trial_seed), config['dims'], config['points'],
+        config['through_origin'], margin=config['margin'])
+    bound, radius, gamma = mistake_bound(points, labels, theta, theta_0,
+                                         config['through_origin'])
+    for algo in config['algos']:
+      _, _, stats = ALGOS[algo](points, labels, algo_params)
+      records.append({'trial': trial, 'algo': algo,
+                      'mistakes': stats.mistakes, 'bound': bound,
+                      'R': radius, 'gamma': gamma,
+                      'converged_epoch': stats.converged_epoch,
+                      'seconds': stats.seconds})
+  return records
+
+class _Summary:
+  """Running aggregates of the trial records per algorithm."""
+
+  def __init__(self, algos):
+    self.totals = {algo: {'trials': 0, 'converged': 0, 'violations': 0,
+                          'mistakes_sum': 0, 'mistakes_max': 0,
+                          'ratio_sum': 0.0, 'ratio_max': 0.0,
+                          'seconds_sum': 0.0}
+                   for algo in algos}
+
+  def add(self, record):
+    totals = self.totals[record['algo']]
+    ratio = record['mistakes'] / record['bound']
+    totals['trials'] += 1
+    totals['converged'] += record['converged_epoch'] is not None
+    totals['violations'] += record['mistakes'] > record['bound']
+    totals['mistakes_sum'] += record['mistakes']
+    totals['mistakes_max'] = max(totals['mistakes_max'], record['mistakes'])
+    totals['ratio_sum'] += ratio
+    totals['ratio_max'] = max(totals['ratio_max'], ratio)
+    totals['seconds_sum'] += record['seconds']
+
+  def result(self):
+    """Returns a dictionary of the aggregates by algorithm.
+
+    The ratios are the numbers of mistakes divided by the bound, a violation
+    is a trial with more mistakes than the bound.
+    """
+    result = {}
+    for algo, totals in self.totals.items():
+      trials = max(1, totals['trials'])
+      result[algo] = {'trials': totals['trials'],
+                      'converged': totals['converged'],
+                      'violations': totals['violations'],
+                      'mistakes_mean': totals['mistakes_sum'] / trials,
+                      'mistakes_max': totals['mistakes_max'],
+                      'ratio_mean': totals['ratio_sum'] / trials,
+                      'ratio_max': totals['ratio_max'],
+                      'seconds_mean': totals['seconds_sum'] / trials}
+    return result
+
+def _mistake_bound_test():
+  points = np.array([[1.0, -2.0],
+                     [0.0, 0.0]])
+  labels = np.array([[1, -1]])
+  theta = np.array([[1.0], [0.0]])
+  # R = 2 and gamma = 1 through origin, R = sqrt(5) with the extension.
+  if mistake_bound(points, labels, theta, 0.0, True) != (4.0, 2.0, 1.0):
+    print("Wrong mistake bound through origin.")
+  bound, radius, gamma = mistake_bound(points, labels, theta, 0.0, False)
+  if not np.isclose(bound, 5.0) or not np.isclose(radius, 5 ** 0.5) or \
+     gamma != 1.0:
+    print("Wrong mistake bound with an offset.")
+  if mistake_bound(points, -labels, theta, 0.0, True)[0] != np.inf:
+    print("A mistake bound for a separator that does not separate.")
+
+def _run_trials_test():
+  import tempfile
+  directory = tempfile.mkdtemp()
+  records = []
+  for workers, batch_size in ((1, 8), (3, 1)):
+    output = os.path.join(directory, 'trials{w}.jsonl'.format(w=workers))
+    args = parse_args(['8', '--algos', 'petron', 'as_petron', '--points', '50',
+                       '--margin', '0.05', '--seed', '0',
+                       '--workers', str(workers),
+                       '--batch-size', str(batch_size), '--output', output])
+    summary = run_trials(args)
+    with open(output) as f:
+      trials = [json.loads(line) for line in f]
+    for record in trials:
+      del record['seconds']
+    records.append(sorted(trials, key=lambda r: (r['trial'], r['algo'])))
+    if summary['petron']['trials'] != 8 or \
+       summary['petron']['converged'] != 8 or \
+       summary['petron']['violations'] != 0:
+      print("Wrong summary: {s}.".format(s=summary['petron']))
+    os.remove(output)
+    os.remove(args.summary)
+  os.rmdir(directory)
+  if records[0] != records[1]:
+    print("The trials depend on the number of workers.")
+
+if __name__ == "__main__":
+  main()
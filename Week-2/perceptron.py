@@ -14,8 +14,21 @@ You should have received a copy of the GNU General Public License along with
 this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+import sys
+import time
+
 import numpy as np
 
+# The default memory cap of the kernel row cache of KernelPerceptron.
+DEFAULT_KERNEL_CACHE = 256 * 2**20
+# The bounds of the number of samples whose margins are calculated at once.
+_MIN_BLOCK = 8
+_MAX_BLOCK = 4096
+
 def perceptron(data, labels, params={}, hook=None):
   """Perceptron algorithm implementation.
 
@@ -23,7 +36,8 @@ def perceptron(data, labels, params={}, hook=None):
     data - a numpy array of dimension d by n;
     labels - a numpy array of dimension 1 by n;
     params - a dictionary specifying extra parameters to this algorithm, this
-             algorithm should run a number of iterations equal to T;
+             algorithm should run a number of iterations equal to T; when
+             stats is true, TrainingStats is returned too;
     hook - either None or a function that takes the tuple (th, th0) as an
            argument and displays the separator graphically.
   """
@@ -31,24 +45,15 @@ def perceptron(data, labels, params={}, hook=None):
   T = params.get('T', 100)
   through_origin = params.get('through_origin', False)
 
-  # Your implementation here
-  num_dims, data_size = data.shape
-  theta = np.zeros((num_dims, 1))
-  theta_0 = 0.0
-
+  rows, ys = _as_rows(data, labels)
+  stats = TrainingStats()
+  kernel = _EpochKernel(rows.shape[1], through_origin)
   for t in range(T):
-    for i in range(data_size):
-      x = data[:, i:i+1]
-      y = labels[0, i]
-      prediction = np.dot(np.transpose(theta), x) + theta_0
-      if y * prediction <= 0:
-        theta += y * x
-        if not through_origin:
-          theta_0 += y
-        if hook:
-          hook((theta, theta_0))
+    # theta does not change after an epoch without mistakes.
+    if stats.add_epoch(kernel.epoch(rows, ys, hook), rows.shape[0]) == 0:
+      break
 
-  return (theta, theta_0)
+  return _result(params, (kernel.theta_col, kernel.theta_0), stats, rows, ys)
 
 def averaged_perceptron(data, labels, params={}, hook=None):
   """Averaged perceptron algorithm implementation.
@@ -60,7 +65,8 @@ def averaged_perceptron(data, labels, params={}, hook=None):
     data - a numpy array of dimension d by n;
     labels - a numpy array of dimension 1 by n;
     params - a dictionary specifying extra parameters to this algorithm, this
-             algorithm should run a number of iterations equal to T;
+             algorithm should run a number of iterations equal to T; when
+             stats is true, TrainingStats is returned too;
     hook - either None or a function that takes the tuple (th, th0) as an
            argument and displays the separator graphically.
   """
@@ -68,26 +74,745 @@ def averaged_perceptron(data, labels, params={}, hook=None):
   T = params.get('T', 100)
   through_origin = params.get('through_origin', False)
 
-  # Your implementation here
+  rows, ys = _as_rows(data, labels)
+  stats = TrainingStats()
+  kernel = _EpochKernel(rows.shape[1], through_origin, averaged=True)
+  for t in range(T):
+    if stats.add_epoch(kernel.epoch(rows, ys, hook), rows.shape[0]) == 0:
+      # The rest of the epochs would only add the same theta to the average.
+      kernel.steps += (T - t - 1) * rows.shape[0]
+      break
+
+  return _result(params, kernel.average(), stats, rows, ys)
+
+def active_set_perceptron(data, labels, params={}, hook=None):
+  """Perceptron algorithm that skips the well classified points.
+
+  Every scan_period passes the margins of all the points are calculated at
+  once, and the following passes go sample by sample only over the active set:
+  the points that are misclassified or whose distance to the separator is
+  within the margin band. When a pass over the active set makes no mistakes, a
+  full pass confirms the convergence (and the training stops) or the active set
+  is rebuilt. The passes over the active sets are cheap, so T limits the number
+  of processed samples (T * n) rather than the number of passes.
+
+  Parameters:
+    data - a numpy array of dimension d by n;
+    labels - a numpy array of dimension 1 by n;
+    params - a dictionary specifying extra parameters to this algorithm:
+               T - the maximal number of processed samples in the units of
+                   full passes (100 by default),
+               through_origin - whether the separator goes through origin,
+               band - the distance to the separator within which the correctly
+                      classified points stay active (0 by default),
+               scan_period - the number of passes after which the active set is
+                             rebuilt (1 by default),
+               stats - whether to return TrainingStats too, its epochs are
+                       both the full passes and the passes over the active
+                       sets;
+    hook - either None or a function that takes the tuple (th, th0) as an
+           argument and displays the separator graphically.
+  """
+  T = params.get('T', 100)
+  through_origin = params.get('through_origin', False)
+  band = params.get('band', 0.0)
+  scan_period = params.get('scan_period', 1)
+
+  rows, ys = _as_rows(data, labels)
+  stats = TrainingStats()
+  kernel = _EpochKernel(rows.shape[1], through_origin)
+  budget = T * rows.shape[0]
+  passes = 0
+  while kernel.steps < budget:
+    if passes % scan_period == 0:
+      active = _active_set(rows, ys, kernel, band)
+      active_rows, active_ys = rows[active], ys[active]
+    passes += 1
+    if active.size and \
+       stats.add_epoch(kernel.epoch(active_rows, active_ys, hook),
+                       active.size, full=False):
+      continue
+    if stats.add_epoch(kernel.epoch(rows, ys, hook), rows.shape[0]) == 0:
+      break
+    passes = 0
+
+  return _result(params, (kernel.theta_col, kernel.theta_0), stats, rows, ys)
+
+def parallel_perceptron(data, labels, params={}, hook=None):
+  """Data-parallel perceptron with iterative parameter mixing.
+
+  The samples are split into contiguous shards that are placed in shared
+  memory once; the shared rows are written straight from data (also from a
+  memory-mapped input) and are the only copy of it. Every pass each
+  worker runs a perceptron epoch over its shard starting from the current
+  mixed separator, then the shard separators are mixed into the next one.
+  Only theta, theta_0 and the mistake counts cross the process boundaries. The
+  training stops after a pass in which no shard makes a mistake.
+
+  Parameters:
+    data - a numpy array of dimension d by n;
+    labels - a numpy array of dimension 1 by n;
+    params - a dictionary specifying extra parameters to this algorithm:
+               T - the maximal number of passes (100 by default),
+               through_origin - whether the separator goes through origin,
+               num_workers - the number of processes and shards, the number of
+                             CPUs by default,
+               mixing - 'uniform' to average the shard separators, 'mistakes'
+                        to weight them by the shard mistake counts ('uniform'
+                        by default),
+               stats - whether to return TrainingStats too;
+    hook - either None or a function that takes the tuple (th, th0) as an
+           argument, it is called with every mixed separator.
+  """
+  T = params.get('T', 100)
+  through_origin = params.get('through_origin', False)
+  num_workers = params.get('num_workers') or os.cpu_count()
+  mixing = params.get('mixing', 'uniform')
+  assert mixing in ('uniform', 'mistakes'), 'unknown mixing'
+
+  num_dims, num_samples = data.shape
+  num_shards = max(1, min(num_workers, num_samples))
+  bounds = np.linspace(0, num_samples, num_shards + 1).astype(int)
+  theta = np.zeros(num_dims)
+  theta_0 = 0.0
+  stats = TrainingStats()
+
+  hplane = _import_hyperplane()
+  blocks = {}
+  try:
+    # The layout of _as_rows, built in the shared block directly.
+    blocks['rows'] = hplane.SharedArray.create(np.transpose(data), order='C',
+                                               dtype=np.float64)
+    blocks['ys'] = hplane.SharedArray.create(labels[0], order='C',
+                                             dtype=np.float64)
+    descriptors = {key: block.descriptor for key, block in blocks.items()}
+    with ProcessPoolExecutor(num_shards, initializer=_attach_shards,
+                             initargs=(descriptors,)) as executor:
+      for t in range(T):
+        futures = [executor.submit(_shard_epoch, start, end, theta, theta_0,
+                                   through_origin)
+                   for start, end in zip(bounds[:-1], bounds[1:])]
+        results = [future.result() for future in futures]
+        mistakes = np.array([result[2] for result in results], dtype=float)
+        if stats.add_epoch(int(mistakes.sum()), num_samples) == 0:
+          break
+        if mixing == 'uniform':
+          weights = np.diff(bounds) > 0
+          weights = weights / weights.sum()
+        else:
+          weights = mistakes / mistakes.sum()
+        theta = sum(w * result[0] for w, result in zip(weights, results))
+        theta_0 = sum(w * result[1] for w, result in zip(weights, results))
+        if hook:
+          hook((theta.reshape(-1, 1), theta_0))
+    return _result(params, (theta.reshape(-1, 1), theta_0), stats,
+                   blocks['rows'].array, blocks['ys'].array)
+  finally:
+    for block in blocks.values():
+      block.release(unlink=True)
+
+class TrainingStats:
+  """Aggregate statistics of a training run.
+
+  The learners fill it once per epoch, so it costs nothing per update unlike a
+  counting hook. It is returned as the third element of the result when the
+  stats parameter is true.
+
+  Attributes:
+    epoch_mistakes - a list of the numbers of mistakes per epoch;
+    samples - the number of the samples processed by all the epochs (an epoch
+              over an active set counts its size);
+    converged_epoch - the number (from 1) of the first full epoch without
+                      mistakes, None if the training stopped before it;
+    seconds - the training time;
+    margin - the minimal signed distance y (theta^T x + theta_0) / |theta|
+             of the training samples to the returned separator.
+  """
+
+  def __init__(self):
+    self.epoch_mistakes = []
+    self.samples = 0
+    self.converged_epoch = None
+    self.seconds = 0.0
+    self.margin = None
+    self._start = time.perf_counter()
+
+  @property
+  def mistakes(self):
+    """The total number of mistakes (updates)."""
+    return sum(self.epoch_mistakes)
+
+  @property
+  def updates_per_sec(self):
+    """The number of the updates (mistakes) per second."""
+    return self.mistakes / self.seconds if self.seconds else 0.0
+
+  @property
+  def samples_per_sec(self):
+    """The training throughput, the processed samples per second."""
+    return self.samples / self.seconds if self.seconds else 0.0
+
+  def add_epoch(self, mistakes, num_samples, full=True):
+    """Records an epoch and returns its number of mistakes.
+
+    Parameters:
+      mistakes - the number of mistakes in the epoch;
+      num_samples - the number of the samples the epoch went over;
+      full - whether the epoch went over all the samples, only such an epoch
+             may be the converged one.
+    """
+    self.epoch_mistakes.append(mistakes)
+    self.samples += num_samples
+    if full and mistakes == 0 and self.converged_epoch is None:
+      self.converged_epoch = len(self.epoch_mistakes)
+    return mistakes
+
+  def finish(self, separator, rows, ys):
+    """Stops the clock and calculates the margin of the final separator."""
+    self.seconds = time.perf_counter() - self._start
+    theta, theta_0 = separator
+    norm = np.linalg.norm(theta)
+    margins = ys * (np.dot(rows, theta[:, 0]) + theta_0)
+    self.margin = float(np.min(margins) / norm) if norm else 0.0
+
+def _result(params, separator, stats, rows, ys):
+  """Forms the result of a learner: the separator and optionally the stats."""
+  if not params.get('stats', False):
+    return separator
+  stats.finish(separator, rows, ys)
+  return separator + (stats,)
+
+# The shared samples attached by a parallel_perceptron worker.
+_shards = {}
+
+def _import_hyperplane():
+  """Imports the Week-1 hyperplane module, only parallel_perceptron needs it.
+
+  The path is resolved from this file, so the module imports from any
+  working directory.
+  """
+  # FIXME: find a better way.
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                      'Week-1')
+  if path not in sys.path:
+    sys.path.append(path)
+  import hyperplane
+  return hyperplane
+
+def _attach_shards(descriptors):
+  """Worker initializer of parallel_perceptron: attaches the shared samples."""
+  hplane = _import_hyperplane()
+  for key, descriptor in descriptors.items():
+    _shards[key] = hplane.SharedArray.attach(descriptor)
+
+def _shard_epoch(start, end, theta, theta_0, through_origin):
+  """Worker side of parallel_perceptron: a pass over the samples [start, end).
+
+  Returns the tuple (theta, theta_0, mistakes) after the pass.
+  """
+  kernel = _EpochKernel(theta.shape[0], through_origin)
+  kernel.theta[:] = theta
+  kernel.theta_0 = theta_0
+  mistakes = kernel.epoch(_shards['rows'].array[start:end],
+                          _shards['ys'].array[start:end])
+  return (kernel.theta, kernel.theta_0, mistakes)
+
+class OnlinePerceptron:
+  """Perceptron (or averaged perceptron) trained on a stream of chunks.
+
+  Every partial_fit call makes a single pass over a chunk and continues from
+  the state left by the previous calls, so feeding the chunks of a data set
+  one by one gives the same separator as an epoch of perceptron (or of
+  averaged_perceptron) over the whole data set. Only the current chunk is held
+  in memory. The averaged state is the lazy one of _EpochKernel, the average
+  always covers all the samples seen so far.
+  """
+
+  def __init__(self, averaged=False, through_origin=False):
+    """Creates an untrained model.
+
+    Parameters:
+      averaged - whether theta and theta_0 are the averages of all the
+                 intermediate ones;
+      through_origin - whether the offset stays zero.
+    """
+    self.averaged = averaged
+    self.through_origin = through_origin
+    self.mistakes = 0
+    self._kernel = None
+
+  @property
+  def num_samples(self):
+    """The number of the samples seen so far."""
+    return self._kernel.steps if self._kernel else 0
+
+  @property
+  def separator(self):
+    """The tuple (theta, theta_0) of the model, theta is a column vector."""
+    assert self._kernel, 'the model has not seen any data'
+    if self.averaged and self._kernel.steps:
+      return self._kernel.average()
+    return (self._kernel.theta_col.copy(), self._kernel.theta_0)
+
+  def partial_fit(self, data, labels, hook=None):
+    """Updates the model with a chunk of samples.
+
+    Parameters:
+      data - a numpy array of dimension d by m;
+      labels - a numpy array of dimension 1 by m;
+      hook - either None or a function that takes the tuple (th, th0), it is
+             called after every update.
+    Returns the model itself.
+    """
+    rows, ys = _as_rows(data, labels)
+    if self._kernel is None:
+      self._kernel = _EpochKernel(rows.shape[1], self.through_origin,
+                                  self.averaged)
+    assert rows.shape[1] == self._kernel.theta.shape[0], \
+           'the number of dimensions has changed'
+    self.mistakes += self._kernel.epoch(rows, ys, hook)
+    return self
+
+  def fit_chunks(self, chunks, hook=None):
+    """Updates the model with every chunk of an iterable.
+
+    Parameters:
+      chunks - an iterable of the tuples (data, labels), e.g. from
+               linseptools.iterate_chunks or a generator;
+      hook - see partial_fit.
+    Returns the model itself.
+    """
+    for data, labels in chunks:
+      self.partial_fit(data, labels, hook)
+    return self
+
+  def decision_function(self, data):
+    """Calculates theta^T x + theta_0 for a numpy array of dimension d by m.
+
+    Returns a numpy array of dimension 1 by m.
+    """
+    theta, theta_0 = self.separator
+    return np.dot(np.transpose(theta), data) + theta_0
+
+  def predict(self, data):
+    """Predicts the labels (+1, -1 or 0 on the boundary) of new data.
+
+    Parameters:
+      data - a numpy array of dimension d by m.
+    Returns a numpy array of dimension 1 by m.
+    """
+    return np.sign(self.decision_function(data))
+
+def _active_set(rows, ys, kernel, band):
+  """Finds the points that are misclassified or close to the separator.
+
+  Parameters:
+    rows, ys - the samples and the labels (see _as_rows);
+    kernel - _EpochKernel with the current separator;
+    band - the distance to the separator within which the correctly classified
+           points are active.
+  Returns an array of the active point indices.
+  """
+  margins = np.dot(rows, kernel.theta)
+  margins += kernel.theta_0
+  margins *= ys
+  return np.flatnonzero(margins <= band * np.linalg.norm(kernel.theta))
+
+class KernelPerceptron:
+  """Kernel perceptron with a bounded cache of the Gram matrix rows.
+
+  The model is kept in the dual form: a mistake coefficient (alpha) per
+  training sample. During the training the values of the decision function
+  are maintained for all the training samples at once, so checking a sample is
+  O(1), and a mistake on sample j adds the j-th Gram row to them. The rows are
+  served from an LRU cache with a memory cap, so the samples that are
+  misclassified again in the later passes do not recompute their kernel
+  values.
+  """
+
+  def __init__(self, kernel='poly', degree=2, coef0=1.0, gamma=1.0,
+               through_origin=False, cache_bytes=DEFAULT_KERNEL_CACHE):
+    """Creates an untrained model.
+
+    Parameters:
+      kernel - 'poly' for (x.z + coef0)^degree or 'rbf' for
+               exp(-gamma * |x - z|^2);
+      degree, coef0 - the polynomial kernel parameters;
+      gamma - the RBF kernel parameter;
+      through_origin - whether the offset stays zero;
+      cache_bytes - the memory cap of the Gram row cache.
+    """
+    assert kernel in ('poly', 'rbf'), 'unknown kernel'
+    self.kernel = kernel
+    self.degree = degree
+    self.coef0 = coef0
+    self.gamma = gamma
+    self.through_origin = through_origin
+    self.cache_bytes = cache_bytes
+    self.alphas = None
+    self.theta_0 = 0.0
+    self.cache_hits = 0
+    self.cache_misses = 0
+    self._support = None
+    self._support_weights = None
+
+  def fit(self, data, labels, T=100):
+    """Trains the model.
+
+    Parameters:
+      data - a numpy array of dimension d by n;
+      labels - a numpy array of dimension 1 by n;
+      T - the maximal number of passes, the training stops after a pass without
+          mistakes.
+    Returns the model itself.
+    """
+    rows, ys = _as_rows(data, labels)
+    num_samples = rows.shape[0]
+    cache = _KernelRowCache(self, rows,
+                            max(1, self.cache_bytes // (8 * num_samples)))
+    self.alphas = np.zeros(num_samples)
+    self.theta_0 = 0.0
+    # The decision function values (without the offset) for all samples.
+    values = np.zeros(num_samples)
+
+    for t in range(T):
+      mistakes = 0
+      i = 0
+      while i < num_samples:
+        wrong = ys[i:] * (values[i:] + self.theta_0) <= 0
+        first = wrong.argmax()
+        if not wrong[first]:
+          break
+        j = i + first
+        y = ys[j]
+        self.alphas[j] += 1
+        values += y * cache.row(j)
+        if not self.through_origin:
+          self.theta_0 += y
+        mistakes += 1
+        i = j + 1
+      if mistakes == 0:
+        break
+
+    self.cache_hits, self.cache_misses = cache.hits, cache.misses
+    support = np.flatnonzero(self.alphas)
+    self._support = rows[support]
+    self._support_weights = self.alphas[support] * ys[support]
+    return self
+
+  def decision_function(self, data, batch_size=4096):
+    """Calculates the decision function for new data.
+
+    Parameters:
+      data - a numpy array of dimension d by m;
+      batch_size - the number of points whose kernel values are calculated at
+                   once.
+    Returns a numpy array of dimension 1 by m.
+    """
+    points = np.transpose(data)
+    result = np.empty((1, points.shape[0]))
+    for start in range(0, points.shape[0], batch_size):
+      batch = points[start:start + batch_size]
+      gram = self._kernel_matrix(batch, self._support)
+      result[0, start:start + batch.shape[0]] = \
+          np.dot(gram, self._support_weights) + self.theta_0
+    return result
+
+  def predict(self, data, batch_size=4096):
+    """Predicts the labels (+1, -1 or 0 on the boundary) of new data.
+
+    Parameters:
+      data - a numpy array of dimension d by m;
+      batch_size - see decision_function.
+    Returns a numpy array of dimension 1 by m.
+    """
+    return np.sign(self.decision_function(data, batch_size))
+
+  def _kernel_matrix(self, a, b):
+    """Calculates the kernel values for all pairs of rows of a and b."""
+    products = np.dot(a, np.transpose(b))
+    if self.kernel == 'poly':
+      return (products + self.coef0) ** self.degree
+    sq_dists = np.sum(a * a, axis=1)[:, None] + np.sum(b * b, axis=1) - \
+               2 * products
+    return np.exp(-self.gamma * np.maximum(sq_dists, 0.0))
+
+class _KernelRowCache:
+  """LRU cache of the Gram matrix rows of the training samples."""
+
+  def __init__(self, model, rows, capacity):
+    """Creates an empty cache.
+
+    Parameters:
+      model - KernelPerceptron whose kernel is used;
+      rows - an n by d array (see _as_rows) of the training samples;
+      capacity - the maximal number of the cached rows.
+    """
+    self.model = model
+    self.rows = rows
+    self.capacity = capacity
+    self.hits = 0
+    self.misses = 0
+    self._rows = OrderedDict()
+
+  def row(self, j):
+    """Returns the kernel values between sample j and all the samples."""
+    row = self._rows.get(j)
+    if row is not None:
+      self.hits += 1
+      self._rows.move_to_end(j)
+      return row
+    self.misses += 1
+    row = self.model._kernel_matrix(self.rows, self.rows[j:j+1])[:, 0]
+    self._rows[j] = row
+    if len(self._rows) > self.capacity:
+      self._rows.popitem(last=False)
+    return row
+
+def _as_rows(data, labels):
+  """Converts the data and the labels into the layout of _EpochKernel.
+
+  Parameters:
+    data - a numpy array of dimension d by n;
+    labels - a numpy array of dimension 1 by n.
+  The transposed float64 views of linseptools.load_input_file already have
+  this layout and are returned as they are, so a memory-mapped input is read
+  straight from the file. Other data (a d by n C-ordered array, another dtype)
+  is copied once into n by d rows.
+  Result:
+    rows - an n by d array of float64 with a sample per (unit stride) row;
+    ys - an array of n float64 labels.
+  """
+  rows = np.transpose(data)
+  if rows.dtype != np.float64 or rows.strides[1] != rows.itemsize:
+    rows = np.ascontiguousarray(rows, dtype=np.float64)
+  ys = np.asarray(labels[0], dtype=np.float64)
+  return (rows, ys)
+
+class _EpochKernel:
+  """Perceptron training state with an allocation-free epoch.
+
+  theta is kept as a flat array and updated in place. The margins of a block of
+  samples are calculated with a single matrix-vector product, the samples up to
+  the first mistake in the block are accepted, and the next block starts right
+  after the mistake. The block grows while there are no mistakes and shrinks
+  back after one. The mistakes and the updates are the same as in the
+  sample-by-sample loop, so is theta.
+
+  The averaging is lazy: an update made at step c is present in the thetas of
+  the steps c..N, so the sum of all the intermediate thetas is
+  (N + 1) * theta - sum(c * update). Only the weighted sum of the updates is
+  kept, which costs O(d) per mistake instead of O(d) per sample.
+  """
+
+  def __init__(self, num_dims, through_origin, averaged=False):
+    """Creates the zero state.
+
+    Parameters:
+      num_dims - the number of dimensions;
+      through_origin - whether theta_0 stays zero;
+      averaged - whether to keep the state for the average of the
+                 intermediate thetas and theta_0s (see average).
+    """
+    self.through_origin = through_origin
+    self.theta = np.zeros(num_dims)
+    # A column view of theta for the hooks and the result.
+    self.theta_col = self.theta.reshape(-1, 1)
+    self.theta_0 = 0.0
+    # The number of the processed samples.
+    self.steps = 0
+    self.theta_weighted = np.zeros(num_dims) if averaged else None
+    self.theta_0_weighted = 0.0
+    self._update = np.empty(num_dims)
+    self._margins = np.empty(_MAX_BLOCK)
+    self._wrong = np.empty(_MAX_BLOCK, dtype=bool)
+
+  def epoch(self, rows, ys, hook=None):
+    """Runs a pass over the samples.
+
+    Parameters:
+      rows - the n by d rows of _as_rows;
+      ys - the n float64 labels of _as_rows;
+      hook - either None or a function that takes the tuple (th, th0).
+    Returns the number of mistakes.
+    """
+    num_samples = rows.shape[0]
+    mistakes = 0
+    block = _MIN_BLOCK
+    i = 0
+    while i < num_samples:
+      end = min(i + block, num_samples)
+      margins = self._margins[:end - i]
+      wrong = self._wrong[:end - i]
+      np.dot(rows[i:end], self.theta, out=margins)
+      margins += self.theta_0
+      margins *= ys[i:end]
+      np.less_equal(margins, 0.0, out=wrong)
+      first = wrong.argmax()
+      if not wrong[first]:
+        self.steps += end - i
+        i = end
+        block = min(2 * block, _MAX_BLOCK)
+        continue
+
+      j = i + first
+      self.steps += first + 1
+      y = ys[j]
+      np.multiply(rows[j], y, out=self._update)
+      self.theta += self._update
+      if not self.through_origin:
+        self.theta_0 += y
+      if self.theta_weighted is not None:
+        self._update *= self.steps
+        self.theta_weighted += self._update
+        if not self.through_origin:
+          self.theta_0_weighted += self.steps * y
+      mistakes += 1
+      if hook:
+        hook((self.theta_col, self.theta_0))
+      i = j + 1
+      block = _MIN_BLOCK
+    return mistakes
+
+  def average(self):
+    """Reconstructs the average of the intermediate thetas and theta_0s.
+
+    Returns the tuple (theta, theta_0) of averages over all the processed
+    samples, theta is a column vector.
+    """
+    steps = self.steps
+    theta = ((steps + 1) * self.theta - self.theta_weighted) / steps
+    theta_0 = ((steps + 1) * self.theta_0 - self.theta_0_weighted) / steps
+    return (theta.reshape(-1, 1), theta_0)
+
+def _per_sample_perceptron(data, labels, T, through_origin, averaged):
+  """The original sample-by-sample (averaged) perceptron loop, a reference."""
   num_dims, data_size = data.shape
   theta = np.zeros((num_dims, 1))
   theta_0 = 0.0
   theta_sum = np.zeros((num_dims, 1))
   theta_0_sum = 0.0
-
   for t in range(T):
     for i in range(data_size):
       x = data[:, i:i+1]
       y = labels[0, i]
-      prediction = np.dot(np.transpose(theta), x) + theta_0
-      if y * prediction <= 0:
+      if y * (np.dot(np.transpose(theta), x) + theta_0) <= 0:
         theta += y * x
         if not through_origin:
           theta_0 += y
-        if hook:
-          hook((theta, theta_0))
       theta_sum += theta
       theta_0_sum += theta_0
+  if averaged:
+    return (theta_sum / (T * data_size), theta_0_sum / (T * data_size))
+  return (theta, theta_0)
+
+def _noisy_input(seed, num_dims=3, num_points=200):
+  """Random points labeled by a random separator with some label noise."""
+  rng = np.random.default_rng(seed)
+  data = rng.standard_normal((num_dims, num_points))
+  margins = np.dot(rng.standard_normal((1, num_dims)), data) + 0.2
+  labels = np.where(margins + 0.3 * rng.standard_normal((1, num_points)) >= 0,
+                    1.0, -1.0)
+  return (data, labels)
+
+def _separable_input(seed, num_dims=3, num_points=200, margin=0.1):
+  """Random points labeled by a random separator, none closer than margin."""
+  rng = np.random.default_rng(seed)
+  data = rng.standard_normal((num_dims, 2 * num_points))
+  theta = rng.standard_normal((1, num_dims))
+  dists = (np.dot(theta, data) + 0.2) / np.linalg.norm(theta)
+  keep = np.flatnonzero(np.abs(dists[0]) >= margin)[:num_points]
+  return (data[:, keep], np.where(dists[:, keep] > 0, 1.0, -1.0))
+
+def _training_score(data, labels, theta, theta_0):
+  return int(np.sum(np.sign(np.dot(np.transpose(theta), data) + theta_0) ==
+                    labels))
+
+def _epoch_kernel_test():
+  for seed in range(10):
+    data, labels = _noisy_input(seed)
+    for through_origin, T in itertools.product((False, True), (1, 7)):
+      params = {'T': T, 'through_origin': through_origin}
+      theta, theta_0 = perceptron(data, labels, params)
+      expected = _per_sample_perceptron(data, labels, T, through_origin, False)
+      if (theta != expected[0]).any() or theta_0 != expected[1]:
+        print("Wrong perceptron for seed {s}.".format(s=seed))
+      theta, theta_0 = averaged_perceptron(data, labels, params)
+      expected = _per_sample_perceptron(data, labels, T, through_origin, True)
+      if not np.allclose(theta, expected[0], rtol=1e-12, atol=1e-12) or \
+         not np.isclose(theta_0, expected[1], rtol=1e-12, atol=1e-12):
+        print("Wrong averaged perceptron for seed {s}.".format(s=seed))
+
+def _active_set_test():
+  for seed in range(5):
+    data, labels = _separable_input(seed)
+    for band, scan_period in ((0.0, 1), (0.5, 3)):
+      params = {'band': band, 'scan_period': scan_period, 'stats': True}
+      theta, theta_0, stats = active_set_perceptron(data, labels, params)
+      if stats.converged_epoch is None or \
+         _training_score(data, labels, theta, theta_0) != data.shape[1]:
+        print("The active-set perceptron did not converge for seed {s}."
+              .format(s=seed))
+
+def _kernel_perceptron_test():
+  # XOR-like labels, separable by the quadratic kernel only.
+  rng = np.random.default_rng(0)
+  data = rng.uniform(-1.0, 1.0, (2, 400))
+  products = data[0:1] * data[1:2]
+  data = data[:, np.abs(products[0]) >= 0.05]
+  labels = np.sign(data[0:1] * data[1:2])
+
+  model = KernelPerceptron(kernel='poly', degree=2).fit(data, labels, T=200)
+  if (model.predict(data) != labels).any():
+    print("The kernel perceptron did not fit the XOR data.")
+  # A cache of a single row gives the same model as a large one.
+  small = KernelPerceptron(kernel='poly', degree=2, cache_bytes=1)
+  small.fit(data, labels, T=200)
+  if (small.alphas != model.alphas).any() or \
+     small.theta_0 != model.theta_0 or \
+     small.cache_misses <= model.cache_misses:
+    print("The kernel row cache changed the kernel perceptron.")
+  if model.cache_hits == 0:
+    print("The kernel row cache was never hit.")
+
+def _parallel_perceptron_test():
+  data, labels = _noisy_input(0)
+  # A single shard runs the epochs of perceptron.
+  theta, theta_0 = parallel_perceptron(data, labels,
+                                       {'T': 5, 'num_workers': 1})
+  expected = perceptron(data, labels, {'T': 5})
+  if (theta != expected[0]).any() or theta_0 != expected[1]:
+    print("Wrong parallel perceptron with a single worker.")
+
+  data, labels = _separable_input(0)
+  for mixing in ('uniform', 'mistakes'):
+    params = {'num_workers': 3, 'mixing': mixing, 'stats': True}
+    theta, theta_0, stats = parallel_perceptron(data, labels, params)
+    if stats.converged_epoch is None or \
+       _training_score(data, labels, theta, theta_0) != data.shape[1]:
+      print("The parallel perceptron ({m} mixing) did not converge."
+            .format(m=mixing))
+
+def _online_perceptron_test():
+  data, labels = _noisy_input(0)
+  chunks = [(data[:, start:start + 37], labels[:, start:start + 37])
+            for start in range(0, data.shape[1], 37)]
+  for averaged in (False, True):
+    learner = averaged_perceptron if averaged else perceptron
+    model = OnlinePerceptron(averaged=averaged)
+    # Two passes over the chunks are two epochs, noisy data never converges.
+    for T in (1, 2):
+      model.fit_chunks(chunks)
+      theta, theta_0, stats = learner(data, labels, {'T': T, 'stats': True})
+      if (model.separator[0] != theta).any() or \
+         model.separator[1] != theta_0 or model.mistakes != stats.mistakes or \
+         model.num_samples != T * data.shape[1]:
+        print("Wrong online perceptron (averaged={a}) after {t} passes."
+              .format(a=averaged, t=T))
 
-  sum_count = T * data_size
-  return (theta_sum / sum_count, theta_0_sum / sum_count)
+if __name__ == "__main__":
+  _epoch_kernel_test()
+  _active_set_test()
+  _kernel_perceptron_test()
+  _parallel_perceptron_test()
+  _online_perceptron_test()
@@ -15,7 +15,14 @@ this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import json
+import multiprocessing
+import resource
 import sys
+import time
 
 # FIXME: find a better way.
 sys.path.append('../Week-1')
@@ -24,26 +31,41 @@ import perceptron as petron
 import hyperplane as hpl
 import numpy as np
 
+# The algorithms by their command line names.
+ALGOS = {'petron': petron.perceptron,
+         'av_petron': petron.averaged_perceptron,
+         'as_petron': petron.active_set_perceptron,
+         'par_petron': petron.parallel_perceptron}
+
+# The fields of a benchmark record in the CSV column order.
+BENCHMARK_FIELDS = ['algo', 'points', 'dims', 'T', 'repeat', 'time_min',
+                    'time_median', 'samples_per_sec', 'updates_per_sec',
+                    'mistakes', 'score', 'peak_rss']
+
 def main():
   args = parse_args()
-  run_test(args)
+  if args.self_test:
+    _record_option_test()
+  elif args.benchmark:
+    run_benchmark(args)
+  else:
+    run_test(args)
 
 class AlgoAction(argparse.Action):
   def __init__(self, option_strings, dest, nargs=None, **kwargs):
-    super().__init__(option_strings, dest, **kwargs)
+    super().__init__(option_strings, dest, nargs=nargs, **kwargs)
 
   def __call__(self, parser, namespace, values, option_string=None):
-    if values == 'petron':
-      setattr(namespace, 'algo', petron.perceptron)
-    elif values == 'av_petron':
-      setattr(namespace, 'algo', petron.averaged_perceptron)
+    if isinstance(values, list):
+      setattr(namespace, self.dest, [ALGOS[value] for value in values])
     else:
-      assert 0, 'An argument choice handler was forgotten'
+      setattr(namespace, self.dest, ALGOS[values])
 
-def parse_args():
+def parse_args(argv=None):
   parser = argparse.ArgumentParser(description='A program that tests '
                                                'perceptron algorithm.')
-  parser.add_argument('--algo', '-a', choices=['petron', 'av_petron'],
+  parser.add_argument('--algo', '-a',
+                      choices=list(ALGOS),
                       default=petron.perceptron, action=AlgoAction,
                       help='which algorithm to call (default: petron)')
   parser.add_argument('--points', '-p', metavar='P', type=int, default=100,
@@ -54,6 +76,16 @@ def parse_args():
                       help='the number of iterations in perceptron algorithm')
   parser.add_argument('--visualize', '-v', action='store_true',
                       help='use visualization mode (works only for 2D)')
+  parser.add_argument('--record', metavar='filename.gif', default='',
+                      help='record the separator after the updates and save '
+                           'the animation to a file (works only for 2D)')
+  parser.add_argument('--record-every', metavar='K', type=int, default=1,
+                      help='record every K-th update only (with --record '
+                           'only)')
+  parser.add_argument('--record-interval', metavar='S', type=float,
+                      default=None,
+                      help='the minimal number of seconds between recorded '
+                           'updates (with --record only)')
   parser.add_argument('--silent', '-s', action='store_true',
                       help='disable all printouts')
   parser.add_argument('--through-origin', action='store_true',
@@ -61,12 +93,76 @@ def parse_args():
                            '"through origin" mode of an algorithm')
   parser.add_argument('--dump-input', metavar='filename.txt', default='',
                       help='the name of a file to which the generated points '
-                           'and labels must be dumped')
+                           'and labels must be dumped, .npy and .npz files '
+                           'are binary, other files are text')
   parser.add_argument('--read-input', metavar='filename.txt', default='',
                       help='the name of a file with the input points and '
                            'their labels, the number of points and dimensions '
-                           'are derived from the data in this case')
-  args = parser.parse_args()
+                           '(and the "through origin" mode for .npz) are '
+                           'derived from the data in this case, .npy and .npz '
+                           'files are memory-mapped')
+  parser.add_argument('--generate-to', metavar='filename.npy', default='',
+                      help='generate the points chunk by chunk straight into '
+                           'a .npy file and use the memory-mapped file as the '
+                           'input')
+  parser.add_argument('--chunk-size', metavar='C', type=int,
+                      default=lst.DEFAULT_CHUNK_SIZE,
+                      help='the number of points generated at once (with '
+                           '--generate-to only)')
+  parser.add_argument('--seed', type=int, default=None,
+                      help='random seed, the data is reproducible for the same '
+                           'seed and chunk size (with --generate-to only)')
+  parser.add_argument('--margin', type=float, default=0.0,
+                      help='the minimal distance from a point to the separator '
+                           '(with --generate-to only)')
+  parser.add_argument('--label-noise', type=float, default=0.0,
+                      help='the probability of flipping a label (with '
+                           '--generate-to only)')
+  parser.add_argument('--workers', metavar='W', type=int, default=1,
+                      help='the number of processes generating the data, the '
+                           'data does not depend on it (with --generate-to '
+                           'only)')
+  parser.add_argument('--benchmark', action='store_true',
+                      help='time every combination of the --bench-* values '
+                           'instead of a single run')
+  parser.add_argument('--bench-algos', metavar='A', nargs='+',
+                      choices=list(ALGOS), default=None, action=AlgoAction,
+                      help='the algorithms to benchmark (default: --algo)')
+  parser.add_argument('--bench-points', metavar='P', type=int, nargs='+',
+                      default=None,
+                      help='the numbers of points to benchmark (default: '
+                           '--points)')
+  parser.add_argument('--bench-dims', metavar='D', type=int, nargs='+',
+                      default=None,
+                      help='the numbers of dimensions to benchmark (default: '
+                           '--dims)')
+  parser.add_argument('--bench-iters', metavar='T', type=int, nargs='+',
+                      default=None,
+                      help='the numbers of iterations to benchmark (default: '
+                           '--petron-iter)')
+  parser.add_argument('--repeat', metavar='R', type=int, default=5,
+                      help='the number of timed runs of every configuration '
+                           '(with --benchmark only)')
+  parser.add_argument('--warmup', metavar='W', type=int, default=1,
+                      help='the number of untimed runs of every '
+                           'configuration (with --benchmark only)')
+  parser.add_argument('--bench-json', metavar='filename.json', default='',
+                      help='the file to write the benchmark records to')
+  parser.add_argument('--bench-csv', metavar='filename.csv', default='',
+                      help='the file to write the benchmark records to as CSV')
+  parser.add_argument('--baseline', metavar='filename.json', default='',
+                      help='the benchmark records to compare with, the '
+                           'program fails when a configuration is slower')
+  parser.add_argument('--tolerance', type=float, default=0.1,
+                      help='the relative slowdown of the median time that is '
+                           'not a regression (with --baseline only)')
+  parser.add_argument('--self-test', action='store_true',
+                      help='run the self-tests of the program instead')
+  args = parser.parse_args(argv)
+  args.bench_algos = args.bench_algos or [args.algo]
+  args.bench_points = args.bench_points or [args.points]
+  args.bench_dims = args.bench_dims or [args.dims]
+  args.bench_iters = args.bench_iters or [args.petron_iter]
 
   # Checking restrictions.
   if args.points < 1:
@@ -78,6 +174,31 @@ def parse_args():
              'positive.')
   if args.visualize and args.dims != 2:
     sys.exit('Visualize mode supported only for 2D task.')
+  if args.record and args.dims != 2:
+    sys.exit('Record mode supported only for 2D task.')
+  if args.record_every < 1:
+    sys.exit('The recording period must be positive.')
+  if args.read_input and args.generate_to:
+    sys.exit('The input can be either read or generated to a file.')
+  if args.chunk_size < 1:
+    sys.exit('The chunk size must be positive.')
+  if args.workers < 1:
+    sys.exit('The number of workers must be positive.')
+  if args.margin < 0:
+    sys.exit('The margin must be non-negative.')
+  if not 0 <= args.label_noise <= 1:
+    sys.exit('The label noise must be a probability.')
+  if args.benchmark:
+    if min(args.bench_points) < 1 or min(args.bench_dims) < 1 or \
+       min(args.bench_iters) < 1:
+      sys.exit('The benchmarked points, dimensions and iterations must be '
+               'positive.')
+    if args.repeat < 1:
+      sys.exit('The number of benchmark runs must be positive.')
+    if args.warmup < 0:
+      sys.exit('The number of warmup runs must be non-negative.')
+    if args.read_input or args.generate_to or args.visualize or args.record:
+      sys.exit('Benchmark mode generates its own input and does not draw.')
   return args
 
 def run_test(params):
@@ -92,10 +213,15 @@ def run_test(params):
                dims - the number of dimensions,
                petron_iter - the number of iterations in perceptron algorithm,
                visualize - whether to visualize the result,
+               record - a name of a file to save the training animation to,
+               record_every, record_interval - the recording frequency (see
+                                               lst.TrainingRecorder),
                dump_input - a name of a file to which the input data should be
                             dumped,
                read_input - a name of a file with the input data, the data will
                             be read in this case (not generated),
+               generate_to - a name of a .npy file to generate the input data
+                             to (see _get_input),
                through_origin - use "though origin" mode,
                silent - whether to disable the printouts.
   """
@@ -104,15 +230,25 @@ def run_test(params):
     print('{n} {d}D points will be used.'.format(n=params.points,
                                                  d=params.dims))
   if params.dump_input:
-    np.savetxt(params.dump_input,
-               np.concatenate((points, labels), casting='no'))
-
-  mistakes_counter = 0
-  def mistakes_counter_func(x):
-    nonlocal mistakes_counter
-    mistakes_counter += 1
-  theta, theta_0 = params.algo(points, labels, _get_algo_params(params),
-                               mistakes_counter_func)
+    if _is_binary_input(params.dump_input):
+      lst.save_input(params.dump_input, points, labels, params.through_origin)
+    else:
+      np.savetxt(params.dump_input,
+                 np.concatenate((points, labels), casting='no'))
+
+  recorder = None
+  if params.record:
+    recorder = lst.TrainingRecorder(params.record_every,
+                                    params.record_interval)
+  algo_params = _get_algo_params(params)
+  algo_params['stats'] = True
+  theta, theta_0, stats = params.algo(points, labels, algo_params, recorder)
+  if recorder is not None:
+    recorder.finish((theta, theta_0))
+    recorder.save(params.record, points, labels)
+    if not params.silent:
+      print('{f} frames are saved to {r}.'.format(f=recorder.num_frames,
+                                                  r=params.record))
   if not params.silent:
     print('{a} was used.'.format(a=params.algo))
   if not params.silent:
@@ -125,10 +261,139 @@ def run_test(params):
   if not params.silent:
     print('{s} out of {p} points were correctly '
           'classified.'.format(s=score, p=params.points))
-    print(f'{mistakes_counter} mistakes were made.')
+    print(f'{stats.mistakes} mistakes were made.')
+    if stats.converged_epoch is not None:
+      print(f'The training converged at epoch {stats.converged_epoch}.')
+    print(f'The margin of the training points is {stats.margin:.6g}.')
   if params.visualize and params.dims == 2:
     lst.draw(points, labels, (theta, theta_0))
 
+def run_benchmark(params):
+  """Times the algorithms on a sweep of configurations.
+
+  Every combination of bench_algos, bench_points, bench_dims and bench_iters
+  is run warmup times untimed and repeat times timed on the same generated
+  input (the input depends only on the seed, the points and the dimensions).
+  Every configuration runs in a fresh process, so that its peak memory is
+  measured on its own. The records are printed as JSON lines and optionally
+  written to JSON and CSV files, and compared with a baseline.
+
+  Parameters:
+    params - a class with the required parameters:
+               bench_algos, bench_points, bench_dims, bench_iters - the swept
+                                                                   values,
+               repeat, warmup - the numbers of timed and untimed runs,
+               seed - the input seed (0 if None),
+               through_origin - use "though origin" mode,
+               bench_json, bench_csv - the names of the files to write the
+                                       records to (if not empty),
+               baseline, tolerance - the records to compare with and the
+                                     allowed slowdown (see
+                                     _find_regressions),
+               silent - whether to disable the printouts.
+  """
+  records = []
+  configs = itertools.product(params.bench_points, params.bench_dims,
+                              params.bench_algos, params.bench_iters)
+  for num_points, num_dims, algo, T in configs:
+    algo_params = {'T': T, 'through_origin': params.through_origin}
+    with ProcessPoolExecutor(
+        1, mp_context=multiprocessing.get_context('spawn')) as executor:
+      record = executor.submit(_benchmark_process, algo, algo_params,
+                               num_points, num_dims, params.seed or 0,
+                               params.repeat, params.warmup).result()
+    records.append(record)
+    if not params.silent:
+      print(json.dumps(record))
+
+  if params.bench_json:
+    with open(params.bench_json, 'w') as f:
+      json.dump(records, f, indent=2)
+  if params.bench_csv:
+    with open(params.bench_csv, 'w', newline='') as f:
+      writer = csv.DictWriter(f, fieldnames=BENCHMARK_FIELDS)
+      writer.writeheader()
+      writer.writerows(records)
+  if params.baseline:
+    with open(params.baseline) as f:
+      baseline = json.load(f)
+    regressions = _find_regressions(records, baseline, params.tolerance)
+    for record, base in regressions:
+      print('Regression: {a} points={p} dims={d} T={t}: {c:.6f}s against '
+            '{b:.6f}s.'.format(a=record['algo'], p=record['points'],
+                               d=record['dims'], t=record['T'],
+                               c=record['time_median'],
+                               b=base['time_median']))
+    if regressions:
+      sys.exit('{r} configurations regressed.'.format(r=len(regressions)))
+
+def _benchmark_process(algo, algo_params, num_points, num_dims, seed, repeat,
+                       warmup):
+  """Generates the input and runs a benchmark configuration (see run_benchmark).
+
+  It is the body of a fresh process, the peak_rss of the record is the peak
+  resident set size of this process plus the largest one of its worker
+  processes (par_petron) in bytes.
+  """
+  np.random.seed(seed)
+  points, labels, _, _ = lst.generate_input(num_dims, num_points,
+                                            algo_params['through_origin'])
+  record = _benchmark_config(algo, algo_params, points, labels, repeat, warmup)
+  # ru_maxrss is in kilobytes on Linux.
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + \
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  record.update(points=num_points, dims=num_dims, peak_rss=peak_rss * 1024)
+  return record
+
+def _benchmark_config(algo, algo_params, points, labels, repeat, warmup):
+  """Runs a single benchmark configuration.
+
+  Result:
+    A dictionary with the BENCHMARK_FIELDS but points, dims and peak_rss. The
+    mistakes and the score are of the last run, samples_per_sec is the number
+    of the samples processed by all the epochs (samples times epochs for the
+    full passes) per second of the median time, updates_per_sec is the number
+    of the updates (mistakes) per second of the median time.
+  """
+  algo_params = dict(algo_params, stats=True)
+  times = []
+  for run in range(warmup + repeat):
+    start = time.perf_counter()
+    theta, theta_0, stats = algo(points, labels, algo_params)
+    if run >= warmup:
+      times.append(time.perf_counter() - start)
+  time_median = float(np.median(times))
+  return {'algo': algo.__name__,
+          'T': algo_params['T'],
+          'repeat': repeat,
+          'time_min': min(times),
+          'time_median': time_median,
+          'samples_per_sec': stats.samples / time_median if time_median
+                             else 0.0,
+          'updates_per_sec': stats.mistakes / time_median if time_median
+                             else 0.0,
+          'mistakes': stats.mistakes,
+          'score': int(hpl.score(points, labels, theta, theta_0)[0])}
+
+def _find_regressions(records, baseline, tolerance):
+  """Finds the configurations that became slower than the baseline.
+
+  Parameters:
+    records, baseline - lists of benchmark records;
+    tolerance - the allowed relative growth of the median time.
+  The records are matched by algo, points, dims and T, the configurations
+  missing from the baseline are ignored.
+  Result:
+    A list of the tuples (record, baseline record) of the regressions.
+  """
+  def key(record):
+    return (record['algo'], record['points'], record['dims'], record['T'])
+  base_by_key = {key(base): base for base in baseline}
+  return [(record, base_by_key[key(record)]) for record in records
+          if key(record) in base_by_key and
+             record['time_median'] >
+             base_by_key[key(record)]['time_median'] * (1 + tolerance)]
+
 def _get_algo_params(params):
   """ Forms algorithm (hyper)parameters.
 
@@ -149,15 +414,33 @@ def _get_input(params):
                dims - the number of dimensions,
                read_input - a name of a file with the input data, the data will
                             be read in this case (not generated),
+               generate_to - a name of a .npy file to generate the input data
+                             to chunk by chunk, the file is memory-mapped then,
+               chunk_size, seed, margin, label_noise, workers - the
+                 generate_to mode parameters (see lst.generate_input_file),
+               through_origin - use "though origin" mode,
                silent - whether to disable the printouts.
   Reads input data from a file when the read_input parameter is provided,
   otherwise generates it according to the dims and points parameters. The dims
   and points attributes of the provided params are changed according to the data
-  when it is read from a file.
+  when it is read from a file (and through_origin when a .npz header has it).
+  .npy and .npz files are memory-mapped (see lst.load_input), the others are
+  parsed as text.
   Result:
     Points (numpy [num_dims x num_points] array);
     Labels for those points (numpy [1 x num_points] array);
   """
+  if params.read_input and _is_binary_input(params.read_input):
+    points, labels, header = lst.load_input(params.read_input)
+    params.dims = header['dims']
+    params.points = header['points']
+    if header['through_origin'] is not None:
+      params.through_origin = header['through_origin']
+
+    if not params.silent:
+      print('Input data is mapped from the binary dump file.')
+    return (points, labels)
+
   if params.read_input:
     data = np.loadtxt(params.read_input)
     points = data[0:-1, :]
@@ -169,11 +452,40 @@ def _get_input(params):
       print('Input data is read from the dump file.')
     return (points, labels)
 
+  if params.generate_to:
+    try:
+      lst.generate_input_file(params.generate_to, params.dims, params.points,
+                              params.through_origin,
+                              chunk_size=params.chunk_size, seed=params.seed,
+                              margin=params.margin,
+                              label_noise=params.label_noise,
+                              num_workers=params.workers)
+    except ValueError as error:
+      sys.exit('The data can not be generated: {e}'.format(e=error))
+    if not params.silent:
+      print('Input data is generated to {f}.'.format(f=params.generate_to))
+    return lst.load_input_file(params.generate_to)
+
   points, labels, _, _ = lst.generate_input(params.dims, params.points,
                                             params.through_origin)
   if not params.silent:
     print('Input data is generated.')
   return (points, labels)
 
+def _is_binary_input(filename):
+  return filename.endswith(('.npy', '.npz'))
+
+def _record_option_test():
+  import os
+  import tempfile
+  from PIL import Image
+  filename = os.path.join(tempfile.mkdtemp(), 'training.gif')
+  np.random.seed(0)
+  run_test(parse_args(['--points', '200', '--record', filename, '--silent']))
+  with Image.open(filename) as animation:
+    if animation.n_frames <= 1:
+      print("--record saved {f} frames.".format(f=animation.n_frames))
+  os.remove(filename)
+
 if __name__ == "__main__":
   main()
@@ -19,11 +19,50 @@ this program. If not, see <http://www.gnu.org/licenses/>.
 # All the used assets should be downloaded from there too.
 
 # Implement perceptron, average perceptron, and pegasos
+import os
+import sys
+import functools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import colors
 from matplotlib.image import imread
 
+try:
+  import scipy.sparse as sparse
+except ImportError:
+  sparse = None
+
+# The directory of the weeks, the helper modules are imported from it.
+_WEEKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, os.pardir)
+
+def _import_hyperplane():
+  """ Imports the Week-1 hyperplane module from a path relative to this file.
+
+  Only the packed score and the parallel xval need it, so it is imported by
+  them and the module imports from any working directory.
+  """
+  # FIXME: find a better way.
+  path = os.path.join(_WEEKS_DIR, 'Week-1')
+  if path not in sys.path:
+    sys.path.append(path)
+  import hyperplane
+  return hyperplane
+
+def _import_linseptools():
+  """ Imports the Week-2 linseptools module from a path relative to this file.
+
+  Only a recording test_linear_classifier needs its TrainingRecorder.
+  """
+  # FIXME: find a better way.
+  path = os.path.join(_WEEKS_DIR, 'Week-2')
+  if path not in sys.path:
+    sys.path.append(path)
+  import linseptools
+  return linseptools
+
 
 print("Importing code_for_hw03 (part 2, imported as hw3)")
 
@@ -156,90 +195,427 @@ def signed_dist(x, th, th0):
 ######################################################################
 # Perceptron code
 
+def accepts_order(learner):
+  """ Marks a learner that trains only on the samples in params['order'].
+
+  Cross validation hands such learners the whole data set with the indices of
+  the training fold (see sample_order); the other learners get a copy of the
+  training fold, so a learner that ignores 'order' never sees the test fold.
+  """
+  learner.accepts_order = True
+  return learner
+
 # data is dimension d by n
 # labels is dimension 1 by n
 # T is a positive integer number of steps to run
 # Perceptron algorithm with offset.
 # data is dimension d by n
 # labels is dimension 1 by n
-# T is a positive integer number of steps to run
+# T is a positive integer number of steps to run or a list of them
+# order (optional) is an array of the indices of the samples to train on, in
+# the order of a pass; all the samples in the data order by default
+@accepts_order
 def perceptron(data, labels, params = {}, hook = None):
   # if T not in params, default to 50
   T = params.get('T', 50)
-  (d, n) = data.shape
+  order = sample_order(data, params)
+  if is_sparse(data):
+    return sparse_perceptron(data, labels, T, hook, order = order)
+  d = data.shape[0]
 
   theta = np.zeros((d, 1)); theta_0 = np.zeros((1, 1))
-  for t in range(T):
-    for i in range(n):
+  horizons = checkpoints(T)
+  snapshots = {}
+  for t in range(horizons[-1]):
+    for i in order:
       x = data[:,i:i+1]
       y = labels[:,i:i+1]
       if y * positive(x, theta, theta_0) <= 0.0:
         theta = theta + y * x
         theta_0 = theta_0 + y
         if hook: hook((theta, theta_0))
-  return theta, theta_0
+    if t + 1 in horizons:
+      snapshots[t + 1] = (theta, theta_0)
+  return _pick_snapshots(T, snapshots)
 
+@accepts_order
 def averaged_perceptron(data, labels, params = {}, hook = None):
   T = params.get('T', 100)
-  (d, n) = data.shape
+  order = sample_order(data, params)
+  if is_sparse(data):
+    return sparse_perceptron(data, labels, T, hook, averaged = True,
+                             order = order)
+  d = data.shape[0]
+  horizons = checkpoints(T)
+  snapshots = {}
 
   theta = np.zeros((d, 1)); theta_0 = np.zeros((1, 1))
-  theta_sum = theta.copy()
-  theta_0_sum = theta_0.copy()
-  for t in range(T):
-    for i in range(n):
+  # Lazy averaging: an update made at step c is present in the thetas of the
+  # steps c..T*n, so the sum of the thetas is (T*n + 1) * theta minus the sum
+  # of the updates weighted by their steps.
+  theta_weighted = theta.copy()
+  theta_0_weighted = theta_0.copy()
+  # The same holds for any prefix of the steps, so the average after t passes
+  # comes from the state at the end of the pass t.
+  step = 0
+  for t in range(horizons[-1]):
+    for i in order:
+      step += 1
       x = data[:,i:i+1]
       y = labels[:,i:i+1]
       if y * positive(x, theta, theta_0) <= 0.0:
         theta = theta + y * x
         theta_0 = theta_0 + y
+        theta_weighted += (step * y) * x
+        theta_0_weighted += step * y
         if hook: hook((theta, theta_0))
-      theta_sum = theta_sum + theta
-      theta_0_sum = theta_0_sum + theta_0
-  theta_avg = theta_sum / (T*n)
-  theta_0_avg = theta_0_sum / (T*n)
-  if hook: hook((theta_avg, theta_0_avg))
-  return theta_avg, theta_0_avg
+    if t + 1 in horizons:
+      snapshots[t + 1] = ((step + 1) * theta - theta_weighted) / step, \
+                         ((step + 1) * theta_0 - theta_0_weighted) / step
+  if hook: hook(snapshots[horizons[-1]])
+  return _pick_snapshots(T, snapshots)
+
+def sparse_perceptron(data, labels, T, hook = None, averaged = False,
+                      order = None):
+  """ Perceptron and averaged perceptron for scipy.sparse data.
+
+  Parameters:
+    data - a scipy.sparse matrix of dimension d by n;
+    labels - a numpy array of dimension 1 by n;
+    T - the number of passes over the data or a list of them (see
+        checkpoints);
+    hook - either None or a function that takes the tuple (th, th0);
+    averaged - whether to return the average of the intermediate thetas (the
+               same lazy averaging as in averaged_perceptron);
+    order - the indices of the samples to train on in the pass order, all the
+            samples by default.
+
+  The data is converted to CSC once, so every sample is a slice of the non-zero
+  values and their indices. The predictions and the updates touch only those
+  entries, theta is updated in place.
+  Returns the tuple (th, th0), th is [d x 1] and th0 is [1 x 1] numpy array,
+  or the list of them if T is a list.
+  """
+  data = sparse.csc_matrix(data)
+  data.sum_duplicates()
+  if order is None:
+    order = np.arange(data.shape[1])
+  d = data.shape[0]
+  indptr, indices, values = data.indptr, data.indices, data.data
+  ys = labels[0]
+
+  theta = np.zeros((d, 1)); theta_0 = np.zeros((1, 1))
+  theta_flat = theta[:, 0]
+  theta_weighted = np.zeros(d); theta_0_weighted = np.zeros((1, 1))
+  horizons = checkpoints(T)
+  snapshots = {}
+  step = 0
+  for t in range(horizons[-1]):
+    for i in order:
+      step += 1
+      nz = indices[indptr[i]:indptr[i+1]]
+      x = values[indptr[i]:indptr[i+1]]
+      y = ys[i]
+      if y * np.sign(np.dot(theta_flat[nz], x) + theta_0[0, 0]) <= 0.0:
+        theta_flat[nz] += y * x
+        theta_0 += y
+        if averaged:
+          theta_weighted[nz] += (step * y) * x
+          theta_0_weighted += step * y
+        if hook: hook((theta, theta_0))
+    if t + 1 not in horizons:
+      continue
+    if averaged:
+      snapshots[t + 1] = \
+        ((step + 1) * theta - theta_weighted[:, None]) / step, \
+        ((step + 1) * theta_0 - theta_0_weighted) / step
+    else:
+      snapshots[t + 1] = theta.copy(), theta_0.copy()
+  if averaged and hook: hook(snapshots[horizons[-1]])
+  return _pick_snapshots(T, snapshots)
+
+def sample_order(data, params):
+  """ Returns the indices of the samples a learner trains on (params['order']).
+
+  Cross validation passes the indices of a training fold instead of copying
+  the fold out of the data set.
+  """
+  order = params.get('order')
+  return np.arange(data.shape[1]) if order is None else order
+
+def checkpoints(T):
+  """ Returns the sorted list of the horizons to take snapshots at.
+
+  The perceptrons accept either a number of passes T or a list of them. With a
+  list, a single run of max(T) passes is made and a (th, th0) snapshot is taken
+  at the end of every listed pass, the learner returns the list of snapshots in
+  the order of T. It gives the same result as separate runs for every horizon.
+  """
+  horizons = sorted(set(np.atleast_1d(T).tolist()))
+  assert horizons and horizons[0] > 0, 'horizons must be positive'
+  return horizons
+
+def _pick_snapshots(T, snapshots):
+  if np.isscalar(T):
+    return snapshots[T]
+  return [snapshots[t] for t in T]
+
+def is_sparse(data):
+  return sparse is not None and sparse.issparse(data)
 
 def positive(x, th, th0):
+  if is_sparse(x):
+    return np.sign(np.asarray(x.T@th).T + th0)
   return np.sign(th.T@x + th0)
 
-def score(data, labels, th, th0):
+def score(data, labels, th, th0, packed = False):
+  # The packed mode counts the agreement over bit-packed signs and labels, it
+  # is for dense data only.
+  if packed and not is_sparse(data):
+    return np.sum(_import_hyperplane().score_packed(data, labels, th, th0))
   return np.sum(positive(data, th, th0) == labels)
 
 def eval_classifier(learner, data_train, labels_train, data_test, labels_test,
-                    T):
-  th, th0 = learner(data_train, labels_train, {'T' : T})
-  return score(data_test, labels_test, th, th0)/data_test.shape[1]
+                    T, order = None):
+  # A list of horizons is trained in one run, the result is an array of scores.
+  # With order the learner trains only on those samples of data_train, the
+  # learners not marked with accepts_order get a copy of those samples.
+  if order is not None and not getattr(learner, 'accepts_order', False):
+    data_train, labels_train = data_train[:, order], labels_train[:, order]
+    order = None
+  params = {'T' : T} if order is None else {'T' : T, 'order' : order}
+  result = learner(data_train, labels_train, params)
+  if np.isscalar(T):
+    return score(data_test, labels_test, *result)/data_test.shape[1]
+  return np.array([score(data_test, labels_test, th, th0)
+                   for th, th0 in result])/data_test.shape[1]
+
+def xval_learning_alg(learner, data, labels, k, T, n_jobs = 1):
+  return xval(functools.partial(eval_classifier, learner, T = T), data, labels,
+              k, n_jobs)
+
+def xval(evaluate, data, labels, k, n_jobs = 1):
+  """ Averages the score of a classifier with k-fold cross validation.
 
-def xval_learning_alg(learner, data, labels, k, T):
+  Parameters:
+    evaluate - a function that takes (data_train, labels_train, data_test,
+               labels_test, order = train_order), trains a classifier on the
+               train_order samples of data_train and returns its score; it must
+               be picklable (e.g. a functools.partial of module functions) when
+               n_jobs is not 1;
+    data, labels - the data set and its labels;
+    k - the number of folds;
+    n_jobs - the number of processes training the folds, None for the number
+             of CPUs.
+
+  The shuffle uses its own RandomState(0), so the global random state is not
+  touched and the folds are the same as with np.random.seed(0). The data is
+  neither shuffled nor split: the folds are ranges of the shuffled indices, the
+  learners get the training indices and only the test samples are copied. With
+  several jobs the data is placed in shared memory once and every worker
+  trains whole folds; the scores are summed in the fold order, so the result
+  is the same as the serial one.
+  """
   _, n = data.shape
-  idx = list(range(n))
-  np.random.seed(0)
-  np.random.shuffle(idx)
-  data, labels = data[:,idx], labels[:,idx]
+  perm = np.arange(n)
+  np.random.RandomState(0).shuffle(perm)
 
-  s_data = np.array_split(data, k, axis=1)
-  s_labels = np.array_split(labels, k, axis=1)
+  sizes = [len(fold) for fold in np.array_split(perm, k)]
+  bounds = np.cumsum([0] + sizes)
+  folds = list(zip(bounds[:-1], bounds[1:]))
 
+  if n_jobs == 1:
+    scores = [_eval_fold(evaluate, data, labels, perm, start, end)
+              for start, end in folds]
+  else:
+    scores = _xval_parallel(evaluate, data, labels, perm, folds,
+                            min(k, n_jobs or os.cpu_count()))
   score_sum = 0
-  for i in range(k):
-    data_train = np.concatenate(s_data[:i] + s_data[i+1:], axis=1)
-    labels_train = np.concatenate(s_labels[:i] + s_labels[i+1:], axis=1)
-    data_test = np.array(s_data[i])
-    labels_test = np.array(s_labels[i])
-    score_sum += eval_classifier(learner, data_train, labels_train,
-                                 data_test, labels_test, T)
+  for fold_score in scores:
+    score_sum += fold_score
   return score_sum/k
 
+def _eval_fold(evaluate, data, labels, perm, start, end):
+  """ Evaluates the fold of the samples perm[start:end]. """
+  train_order = np.concatenate((perm[:start], perm[end:]))
+  test_idx = perm[start:end]
+  return evaluate(data, labels, data[:, test_idx], labels[:, test_idx],
+                  order = train_order)
+
+def _xval_parallel(evaluate, data, labels, perm, folds, n_jobs):
+  """ Evaluates the folds in a pool of processes.
+
+  The data, the labels and the permutation are shared, a scipy.sparse matrix
+  is shared as its CSC arrays. Only evaluate, the fold bounds and the scores
+  are sent.
+  Returns the list of the fold scores in the fold order.
+  """
+  arrays = {'labels': labels, 'perm': perm}
+  if is_sparse(data):
+    data = sparse.csc_matrix(data)
+    arrays.update(values = data.data, indices = data.indices,
+                  indptr = data.indptr)
+    shape = data.shape
+  else:
+    arrays['data'] = data
+    shape = None
+  hplane = _import_hyperplane()
+  blocks = {}
+  try:
+    for key, array in arrays.items():
+      blocks[key] = hplane.SharedArray.create(array)
+    descriptors = {key: block.descriptor for key, block in blocks.items()}
+    with ProcessPoolExecutor(n_jobs, initializer = _attach_xval_data,
+                             initargs = (descriptors, shape)) as executor:
+      futures = [executor.submit(_eval_shared_fold, evaluate, start, end)
+                 for start, end in folds]
+      return [future.result() for future in futures]
+  finally:
+    for block in blocks.values():
+      block.release(unlink = True)
+
+# The shared data set attached by an _xval_parallel worker.
+_xval_data = {}
+
+def _attach_xval_data(descriptors, sparse_shape):
+  hplane = _import_hyperplane()
+  blocks = {key: hplane.SharedArray.attach(descriptor)
+            for key, descriptor in descriptors.items()}
+  _xval_data['blocks'] = blocks
+  _xval_data['labels'] = blocks['labels'].array
+  _xval_data['perm'] = blocks['perm'].array
+  if sparse_shape is None:
+    _xval_data['data'] = blocks['data'].array
+  else:
+    _xval_data['data'] = sparse.csc_matrix(
+        (blocks['values'].array, blocks['indices'].array,
+         blocks['indptr'].array), shape = sparse_shape, copy = False)
+
+def _eval_shared_fold(evaluate, start, end):
+  return _eval_fold(evaluate, _xval_data['data'], _xval_data['labels'],
+                    _xval_data['perm'], start, end)
+
+######################################################################
+# Multiclass perceptron
+
+@accepts_order
+def multiclass_perceptron(data, labels, params = {}, hook = None):
+  """ One-vs-rest or all-pairs perceptron for several classes.
+
+  Parameters:
+    data - a numpy array of dimension d by n;
+    labels - a numpy array of dimension 1 by n with the class of every sample;
+    params - a dictionary of extra parameters:
+               T - the number of passes (50 by default),
+               mode - 'ovr' to train a classifier per class against the rest,
+                      'ovo' to train a classifier per pair of classes ('ovr'
+                      by default),
+               order - the indices of the samples to train on in the pass
+                       order (see sample_order);
+    hook - either None or a function that takes the tuple (ths, th0s).
+
+  All the binary perceptrons are trained in the same pass. The scores of all
+  the classifiers a sample is relevant to (all of them for 'ovr', the K - 1
+  pairs with its class for 'ovo') are calculated with a single matrix-vector
+  product and all of them are updated at once. Every classifier makes the
+  same updates as a separate perceptron call over its data would.
+  Returns the tuple (ths, th0s, classes): ths is a d by m array, th0s is a
+  1 by m array, classes is a sorted array of K classes; m is K for 'ovr' and
+  K (K - 1) / 2 for 'ovo' (the pairs of class indices go in the order of
+  itertools.combinations).
+  """
+  T = params.get('T', 50)
+  mode = params.get('mode', 'ovr')
+  assert mode in ('ovr', 'ovo'), 'unknown mode'
+  order = sample_order(data, params)
+  classes, class_idx = np.unique(labels[0, order], return_inverse = True)
+  K = len(classes)
+  d = data.shape[0]
+
+  # For every class: the classifiers it is relevant to and the targets there,
+  # for 'ovr' all of them (None) are scored without gathering their rows.
+  if mode == 'ovr':
+    relevant = [None] * K
+    targets = [np.where(np.arange(K) == c, 1.0, -1.0) for c in range(K)]
+  else:
+    pairs = _class_pairs(K)
+    relevant = [np.flatnonzero((pairs == c).any(axis = 1)) for c in range(K)]
+    targets = [np.where(pairs[r, 0] == c, 1.0, -1.0)
+               for c, r in enumerate(relevant)]
+  m = K if mode == 'ovr' else len(pairs)
+
+  ths_t = np.zeros((m, d)); th0s = np.zeros(m)
+  for t in range(T):
+    for j, i in enumerate(order):
+      x = data[:, i]
+      c = class_idx[j]
+      r = relevant[c]
+      if r is None:
+        scores = ths_t @ x + th0s
+      else:
+        scores = ths_t[r] @ x + th0s[r]
+      wrong = targets[c] * np.sign(scores) <= 0.0
+      if wrong.any():
+        r = np.flatnonzero(wrong) if r is None else r[wrong]
+        y = targets[c][wrong]
+        ths_t[r] += y[:, None] * x
+        th0s[r] += y
+        if hook: hook((ths_t.T, th0s[None, :]))
+  return ths_t.T, th0s[None, :], classes
+
+def multiclass_predict(data, ths, th0s, classes, mode = 'ovr'):
+  """ Predicts the classes with a multiclass_perceptron model.
+
+  Parameters:
+    data - a numpy array of dimension d by n;
+    ths, th0s, classes - the model returned by multiclass_perceptron;
+    mode - the mode the model was trained in.
+
+  'ovr' picks the class with the largest score. 'ovo' calculates the scores of
+  all the pairs at once and counts the votes for all the points per pair, the
+  class with the most votes wins (the ties go to the smaller class).
+  Returns a numpy array of dimension 1 by n.
+  """
+  scores = ths.T @ data + th0s.T
+  if mode == 'ovr':
+    return classes[np.argmax(scores, axis = 0)][None, :]
+  votes = np.zeros((len(classes), data.shape[1]))
+  for (a, b), pair_scores in zip(_class_pairs(len(classes)), scores):
+    wins = pair_scores > 0
+    votes[a] += wins
+    votes[b] += ~wins
+  return classes[np.argmax(votes, axis = 0)][None, :]
+
+def _class_pairs(K):
+  return np.array([(a, b) for a in range(K) for b in range(a + 1, K)],
+                  dtype = int).reshape(-1, 2)
+
+def eval_multiclass_classifier(data_train, labels_train, data_test,
+                               labels_test, T, mode = 'ovr', order = None):
+  ths, th0s, classes = multiclass_perceptron(data_train, labels_train,
+                                             {'T' : T, 'mode' : mode,
+                                              'order' : order})
+  predicted = multiclass_predict(data_test, ths, th0s, classes, mode)
+  return np.sum(predicted == labels_test)/data_test.shape[1]
+
+def xval_multiclass(data, labels, k, T, mode = 'ovr', n_jobs = 1):
+  return xval(functools.partial(eval_multiclass_classifier, T = T,
+                                mode = mode), data, labels, k, n_jobs)
+
 ######################################################################
 #   Tests
 
 def test_linear_classifier(dataFun, learner, learner_params = {},
-               draw = True, refresh = True, pause = True):
+               draw = True, refresh = True, pause = True, record = None,
+               record_every = 1):
+  # With record (a .gif or video file name) the separators are only buffered
+  # during the training and the animation is rendered afterwards, every
+  # record_every-th update is recorded.
   data, labels = dataFun()
   d, n = data.shape
-  if draw:
+  if record:
+    hook = _import_linseptools().TrainingRecorder(every = record_every)
+  elif draw:
     ax = plot_data(data, labels)
     def hook(params):
       (th, th0) = params
@@ -250,6 +626,9 @@ def test_linear_classifier(dataFun, learner, learner_params = {},
   else:
     hook = None
   th, th0 = learner(data, labels, hook = hook, params = learner_params)
+  if record:
+    hook.finish((th, th0))
+    hook.save(record, data, labels)
   print("Final score", float(score(data, labels, th, th0)) / n)
   print("Params", np.transpose(th), th0)
 
@@ -378,16 +757,32 @@ def bag_of_words(texts, stop_words):
         dictionary[word] = len(dictionary)
   return dictionary
 
-def extract_bow_feature_vectors(reviews, dictionary):
+def extract_bow_feature_vectors(reviews, dictionary, as_sparse = False):
   """
   Inputs a list of string reviews
   Inputs the dictionary of words as given by bag_of_words
   Returns the bag-of-words feature matrix representation of the data.
   The returned matrix is of shape (n, m), where n is the number of reviews
   and m the total number of entries in the dictionary.
+  With as_sparse the matrix is a scipy.sparse CSC matrix of shape (m, n),
+  without scipy a warning is issued and the dense matrix is returned.
   """
 
   num_reviews = len(reviews)
+  if as_sparse and sparse is None:
+    warnings.warn('scipy is not available, the bag-of-words features are '
+                  'extracted as a dense matrix', RuntimeWarning, stacklevel = 2)
+    as_sparse = False
+  if as_sparse:
+    indptr = [0]; indices = []
+    for text in reviews:
+      words = {dictionary[word] for word in extract_words(text)
+               if word in dictionary}
+      indices.extend(sorted(words))
+      indptr.append(len(indices))
+    return sparse.csc_matrix((np.ones(len(indices)), indices, indptr),
+                             shape = (len(dictionary), num_reviews))
+
   feature_matrix = np.zeros([num_reviews, len(dictionary)])
 
   for i, text in enumerate(reviews):
@@ -462,6 +857,7 @@ def load_mnist_single(path_data):
 
 print("Imported tidy_plot, plot_separator, plot_data, plot_nonlin_sep, cv, rv, y, positive, score")
 print("         xval_learning_alg, eval_classifier")
+print("         multiclass_perceptron, multiclass_predict, xval_multiclass")
 print("Tests: test_linear_classifier")
 print("Dataset tools: load_auto_data, std_vals, standard, raw, one_hot, auto_data_and_labels")
 print("               load_review_data, clean, extract_words, bag_of_words, extract_bow_feature_vectors")
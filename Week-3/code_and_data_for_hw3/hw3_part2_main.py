@@ -79,13 +79,15 @@ def process_auto():
   # Your code here to process the auto data
 
   for f_set_idx, features in enumerate(feature_sets):
-    for T in Ts:
-      # Construct the standard data and label arrays
-      auto_data, auto_labels = hw3.auto_data_and_labels(auto_data_all, features)
-      ptron_score = hw3.xval_learning_alg(hw3.perceptron, auto_data,
-                                          auto_labels, 10, T)
-      av_ptron_score = hw3.xval_learning_alg(hw3.averaged_perceptron, auto_data,
-                                             auto_labels, 10, T)
+    # Construct the standard data and label arrays
+    auto_data, auto_labels = hw3.auto_data_and_labels(auto_data_all, features)
+    # All the Ts are trained in a single run per fold.
+    ptron_scores = hw3.xval_learning_alg(hw3.perceptron, auto_data,
+                                         auto_labels, 10, Ts)
+    av_ptron_scores = hw3.xval_learning_alg(hw3.averaged_perceptron, auto_data,
+                                            auto_labels, 10, Ts)
+    for T, ptron_score, av_ptron_score in zip(Ts, ptron_scores,
+                                              av_ptron_scores):
       print(f'Analysis for auto data for feature set {f_set_idx+1} and T = {T}:')
       print('  auto data and labels shape', auto_data.shape, auto_labels.shape)
       print('  Perceptron score is ', ptron_score)
@@ -115,7 +117,8 @@ def process_review():
   rev_dictionary = hw3.reverse_dict(dictionary)
 
   # The standard data arrays for the bag of words
-  review_bow_data = hw3.extract_bow_feature_vectors(review_texts, dictionary)
+  review_bow_data = hw3.extract_bow_feature_vectors(review_texts, dictionary,
+                                                    as_sparse=True)
   review_labels = hw3.rv(review_label_list)
   print('review_bow_data and labels shape', review_bow_data.shape, review_labels.shape)
 
@@ -124,11 +127,11 @@ def process_review():
   #-------------------------------------------------------------------------------
 
   # Your code here to process the review data
-  for T in Ts:
-    ptron_score = hw3.xval_learning_alg(hw3.perceptron, review_bow_data,
-                                        review_labels, 10, T)
-    av_ptron_score = hw3.xval_learning_alg(hw3.averaged_perceptron, review_bow_data,
-                                           review_labels, 10, T)
+  ptron_scores = hw3.xval_learning_alg(hw3.perceptron, review_bow_data,
+                                       review_labels, 10, Ts)
+  av_ptron_scores = hw3.xval_learning_alg(hw3.averaged_perceptron,
+                                          review_bow_data, review_labels, 10, Ts)
+  for T, ptron_score, av_ptron_score in zip(Ts, ptron_scores, av_ptron_scores):
     print(f'Analysis for review data with T = {T}:')
     print('  Perceptron score is ', ptron_score)
     print('  Averaged perceptron score is ', av_ptron_score)
@@ -195,6 +198,15 @@ def process_mnist():
     acc = hw3.get_classification_accuracy(features, labels)
     print('  Top-bottom accuracy:', acc)
 
+  print('Classifying all the digits.')
+  data = np.vstack([mnist_data_all[digit]["images"] for digit in range(10)])
+  labels = np.hstack([mnist_data_all[digit]["labels"] for digit in range(10)])
+  features = raw_mnist_features(data)
+  acc = hw3.xval_multiclass(features, labels, 10, 50, 'ovr')
+  print('  One-vs-rest raw accuracy:', acc)
+  acc = hw3.xval_multiclass(features, labels, 10, 50, 'ovo')
+  print('  All-pairs raw accuracy:', acc)
+
   #-------------------------------------------------------------------------------
   # Analyze MNIST data
   #-------------------------------------------------------------------------------
@@ -38,6 +38,22 @@ def margin(data, labels, thetas, theta_0s):
   """
   return labels * hplane.signed_dist(data, thetas, theta_0s)
 
+def margin_for_set(data, labels, planes):
+  """
+  Calculates margins like margin but for prepared hyperplanes.
+
+  Parameters:
+    data - n data points in d dimensions ([d x n] numpy array of numbers);
+    labels - data labels ([1 x n] numpy array of elements in {+1, -1}, or a
+             single number +1 or -1 for n == 1);
+    planes - m hyperplanes (hplane.HyperplaneSet), the normals are not
+             normalized on every call.
+
+  Returns [m x n] matrix of margins computed for all combinations of data points
+  and hyperplanes.
+  """
+  return labels * planes.signed_dist(data)
+
 def margin_features(data, labels, thetas, theta_0s):
   """
   Calculates margin characteristics for labeled points and hyperplanes.
@@ -14,6 +14,9 @@ You should have received a copy of the GNU General Public License along with
 this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import csv
 import itertools, functools, operator
@@ -237,7 +240,7 @@ def ridge_obj_grad(x, y, th, th0, lam):
   grad_th0 = d_ridge_obj_th0(x, y, th, th0, lam)
   return np.vstack([grad_th, grad_th0])
 
-def sgd(X, y, J, dJ, w0, step_size_fn, max_iter):
+def sgd(X, y, J, dJ, w0, step_size_fn, max_iter, rng = None, order = None):
   """Implements stochastic gradient descent
 
   Inputs:
@@ -261,6 +264,13 @@ def sgd(X, y, J, dJ, w0, step_size_fn, max_iter):
 
   max_iter: the number of iterations to perform
 
+  rng: a np.random.RandomState to draw the samples from, the global
+  random state by default
+
+  order: the indices of the samples (columns of X) to draw from, all the
+  samples by default; it draws the same samples as sgd over X[:, order]
+  without copying them
+
   Returns: a tuple (like gd):
   w: the value of the weight vector at the final step
   fs: the list of values of JJJ found during all the iterations
@@ -268,12 +278,16 @@ def sgd(X, y, J, dJ, w0, step_size_fn, max_iter):
 
   """
   #Your code here
-  data_size = X.shape[1]
+  if rng is None:
+    rng = np.random
+  if order is None:
+    order = np.arange(X.shape[1])
+  data_size = len(order)
   ws = [w0]
-  fs = [J(X[:,0:1], y[:,0:1], w0)]
+  fs = [J(X[:,order[0]:order[0]+1], y[:,order[0]:order[0]+1], w0)]
   cur_w = w0
   for i in range(0, max_iter - 1):
-    sample = np.random.randint(0, data_size)
+    sample = order[rng.randint(0, data_size)]
     cur_x, cur_y = X[:, sample:sample+1], y[:,sample:sample+1]
     cur_w = cur_w - step_size_fn(i) * dJ(cur_x, cur_y, cur_w)
     ws.append(cur_w)
@@ -320,27 +334,30 @@ def sgdTest():
 
 ############################################################
 
-def ridge_min(X, y, lam):
+def ridge_min(X, y, lam, order = None):
   """Returns th, th0 that minimize the ridge regression objective.
 
-  Assumes that X is NOT 1-extended. Interfaces to our sgd by 1-extending
-  and building corresponding initial weights.
+  Assumes that X is NOT 1-extended. Interfaces to our sgd by building
+  initial weights with the offset as the last element; the cost functions
+  split the weights, so X is not 1-extended (copied) for sgd. With order
+  only the samples with those indices are used (see sgd).
   """
   def svm_min_step_size_fn(i):
     return 0.01/(i+1)**0.5
 
-  d, n = X.shape
-  X_extend = np.vstack([X, np.ones((1, n))])
+  d = X.shape[0]
   w_init = np.zeros((d+1, 1))
 
   def J(Xj, yj, th):
-    return float(ridge_obj(Xj[:-1,:], yj, th[:-1,:], th[-1:,:], lam))
+    return float(ridge_obj(Xj, yj, th[:-1,:], th[-1:,:], lam))
 
   def dJ(Xj, yj, th):
-    return ridge_obj_grad(Xj[:-1,:], yj, th[:-1,:], th[-1:,:], lam)
+    return ridge_obj_grad(Xj, yj, th[:-1,:], th[-1:,:], lam)
 
-  np.random.seed(0)
-  w, fs, ws = sgd(X_extend, y, J, dJ, w_init, svm_min_step_size_fn, 1000)
+  # A stream of its own: the same samples as after np.random.seed(0), but the
+  # global random state is not touched, so concurrent calls do not interfere.
+  w, fs, ws = sgd(X, y, J, dJ, w_init, svm_min_step_size_fn, 1000,
+                  np.random.RandomState(0), order)
   return w[:-1,:], w[-1:,:]
 
 #######################################################################
@@ -377,13 +394,14 @@ def make_polynomial_feature_fun(order):
 
 #First finds a predictor on X_train and X_test using the specified value of lam
 #Then runs on X_test, Y_test to find the RMSE
-def eval_predictor(X_train, Y_train, X_test, Y_test, lam):
-  th, th0 = ridge_min(X_train, Y_train, lam)
+#With order only those samples of X_train and Y_train are used for training
+def eval_predictor(X_train, Y_train, X_test, Y_test, lam, order = None):
+  th, th0 = ridge_min(X_train, Y_train, lam, order)
   return np.sqrt(mean_square_loss(X_test, Y_test, th, th0))
 
 #Returns the mean RMSE from cross validation given a dataset (X, y), a value of lam,
 #and number of folds, k
-def xval_learning_alg(X, y, lam, k):
+def xval_learning_alg(X, y, lam, k, n_jobs = 1):
   '''
   Given a learning algorithm and data set, evaluate the learned classifier's score with k-fold
   cross validation.
@@ -392,25 +410,82 @@ def xval_learning_alg(X, y, lam, k):
   data, labels = dataset and its labels.
 
   k: the "k" of k-fold cross validation
-  '''
-  _, n = X.shape
-  idx = list(range(n))
-  np.random.seed(0)
-  np.random.shuffle(idx)
-  X, y = X[:,idx], y[:,idx]
 
-  split_X = np.array_split(X, k, axis=1)
-  split_y = np.array_split(y, k, axis=1)
+  n_jobs: the number of processes training the folds, None for the number of
+  CPUs; the data is placed in shared memory once and the result is the same
+  as the serial one
 
+  The data is neither shuffled nor split, the folds are ranges of shuffled
+  indices: the training gets the indices and only the test samples are copied.
+  '''
+  _, n = X.shape
+  # The same permutation as after np.random.seed(0), without the global state.
+  perm = np.arange(n)
+  np.random.RandomState(0).shuffle(perm)
+
+  sizes = [len(fold) for fold in np.array_split(perm, k)]
+  bounds = np.cumsum([0] + sizes)
+  folds = list(zip(bounds[:-1], bounds[1:]))
+
+  if n_jobs == 1:
+    scores = [_eval_fold(X, y, perm, lam, start, end) for start, end in folds]
+  else:
+    scores = _xval_parallel(X, y, perm, lam, folds,
+                            min(k, n_jobs or os.cpu_count()))
   score_sum = 0
-  for i in range(k):
-    X_train = np.concatenate(split_X[:i] + split_X[i+1:], axis=1)
-    y_train = np.concatenate(split_y[:i] + split_y[i+1:], axis=1)
-    X_test = np.array(split_X[i])
-    y_test = np.array(split_y[i])
-    score_sum += eval_predictor(X_train, y_train, X_test, y_test, lam)
+  for score in scores:
+    score_sum += score
   return score_sum/k
 
+#Evaluates the fold of the samples perm[start:end]
+def _eval_fold(X, y, perm, lam, start, end):
+  train_order = np.concatenate((perm[:start], perm[end:]))
+  test_idx = perm[start:end]
+  return eval_predictor(X, y, X[:, test_idx], y[:, test_idx], lam,
+                        train_order)
+
+#Evaluates the folds in a pool of processes sharing X, y and perm, returns
+#the fold scores in the fold order
+def _xval_parallel(X, y, perm, lam, folds, n_jobs):
+  hplane = _import_hyperplane()
+  blocks = {}
+  try:
+    blocks['X'] = hplane.SharedArray.create(X)
+    blocks['y'] = hplane.SharedArray.create(y)
+    blocks['perm'] = hplane.SharedArray.create(perm)
+    descriptors = {key: block.descriptor for key, block in blocks.items()}
+    with ProcessPoolExecutor(n_jobs, initializer = _attach_xval_data,
+                             initargs = (descriptors,)) as executor:
+      futures = [executor.submit(_eval_shared_fold, lam, start, end)
+                 for start, end in folds]
+      return [future.result() for future in futures]
+  finally:
+    for block in blocks.values():
+      block.release(unlink = True)
+
+#The shared data set attached by an _xval_parallel worker
+_xval_data = {}
+
+#Imports the Week-1 hyperplane module (only the parallel xval needs it) from
+#a path relative to this file, so the module imports from any directory
+def _import_hyperplane():
+  # FIXME: find a better way.
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, os.pardir, 'Week-1')
+  if path not in sys.path:
+    sys.path.append(path)
+  import hyperplane
+  return hyperplane
+
+def _attach_xval_data(descriptors):
+  hplane = _import_hyperplane()
+  for key, descriptor in descriptors.items():
+    _xval_data[key] = hplane.SharedArray.attach(descriptor)
+
+def _eval_shared_fold(lam, start, end):
+  return _eval_fold(_xval_data['X'].array, _xval_data['y'].array,
+                    _xval_data['perm'].array, lam, start, end)
+
 ######################################################################
 # For auto dataset
 